@@ -0,0 +1,114 @@
+"""Compare OCR preprocessing settings on a sample set: payload size and Vision time against accuracy.
+
+Sample directory layout: every sample (name.pdf, name.png, name.jpg, name.jpeg or name.heic) sits next to a
+ground-truth transcription name.txt. Accuracy is reported as character error rate (CER), whitespace ignored.
+Every page of a PDF sample is rasterised and OCR'd, text layer or not.
+
+Run from the repository root, with the Google credentials in .streamlit/secrets.toml:
+
+    python -m benchmarks.ocr_preprocessing_benchmark samples/ --dpi 72 150 200 300 --formats JPEG WEBP PNG
+"""
+import os
+import sys
+import time
+import argparse
+import itertools
+import fitz
+import pillow_heif
+from PIL import Image
+from utilities.process_utils import render_page_for_ocr, preprocess_image_for_ocr, annotate_image_batch, batch_images
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".heic")
+
+
+def load_samples(sample_dir):
+    samples = []
+    for file_name in sorted(os.listdir(sample_dir)):
+        stem, extension = os.path.splitext(file_name)
+        truth_path = os.path.join(sample_dir, f"{stem}.txt")
+        if extension.lower() not in (".pdf",) + IMAGE_EXTENSIONS or not os.path.exists(truth_path):
+            continue
+        with open(truth_path, encoding="utf-8") as f:
+            samples.append((os.path.join(sample_dir, file_name), f.read()))
+    return samples
+
+
+def character_error_rate(predicted, truth):
+    predicted = "".join(predicted.split())
+    truth = "".join(truth.split())
+    if not truth:
+        return 0.0 if not predicted else 1.0
+    # Levenshtein distance over characters, one row at a time
+    previous = list(range(len(truth) + 1))
+    for i, predicted_char in enumerate(predicted, 1):
+        current = [i]
+        for j, truth_char in enumerate(truth, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (predicted_char != truth_char)))
+        previous = current
+    return previous[-1] / len(truth)
+
+
+def prepare_payloads(sample_path, dpi, grayscale, binarize, image_format, max_bytes):
+    if sample_path.lower().endswith(".pdf"):
+        with fitz.open(sample_path) as pdf_document:
+            images = [render_page_for_ocr(page, dpi=dpi, grayscale=grayscale) for page in pdf_document]
+    elif sample_path.lower().endswith(".heic"):
+        images = [pillow_heif.open_heif(sample_path).to_pillow()]
+    else:
+        images = [Image.open(sample_path)]
+    return [
+        preprocess_image_for_ocr(image, grayscale=grayscale, binarize=binarize, image_format=image_format, max_bytes=max_bytes)
+        for image in images
+    ]
+
+
+def run_configuration(samples, dpi, grayscale, binarize, image_format, max_bytes):
+    total_bytes = 0
+    total_seconds = 0.0
+    error_rates = []
+    for sample_path, truth in samples:
+        payloads = prepare_payloads(sample_path, dpi, grayscale, binarize, image_format, max_bytes)
+        total_bytes += sum(len(payload) for payload in payloads)
+        # Pages go out in the same batches as the upload pages send them
+        started = time.perf_counter()
+        texts = []
+        for batch in batch_images(payloads):
+            texts.extend(annotate_image_batch(batch))
+        total_seconds += time.perf_counter() - started
+        # A page Vision failed on (None) counts as no text
+        error_rates.append(character_error_rate("".join(text or "" for text in texts), truth))
+    return {
+        "kb_per_sample": total_bytes / len(samples) / 1024,
+        "ocr_ms_per_sample": total_seconds / len(samples) * 1000,
+        "cer": sum(error_rates) / len(error_rates),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark OCR preprocessing settings")
+    parser.add_argument("sample_dir")
+    parser.add_argument("--dpi", type=int, nargs="+", default=[72, 150, 200, 300])
+    parser.add_argument("--formats", nargs="+", default=["JPEG", "WEBP", "PNG"])
+    parser.add_argument("--max-bytes", type=int, default=600 * 1024)
+    args = parser.parse_args(argv)
+
+    samples = load_samples(args.sample_dir)
+    if not samples:
+        print(f"No samples with ground truth found in {args.sample_dir}")
+        return 1
+
+    print(f"{len(samples)} samples")
+    print(f"{'dpi':>5} {'format':>6} {'gray':>5} {'binary':>6} {'KB/sample':>10} {'OCR ms':>8} {'CER':>7}")
+    for dpi, image_format, grayscale, binarize in itertools.product(args.dpi, args.formats, [True, False], [False, True]):
+        if binarize and not grayscale:
+            continue
+        result = run_configuration(samples, dpi, grayscale, binarize, image_format, args.max_bytes)
+        print(
+            f"{dpi:>5} {image_format:>6} {str(grayscale):>5} {str(binarize):>6} "
+            f"{result['kb_per_sample']:>10.1f} {result['ocr_ms_per_sample']:>8.0f} {result['cer']:>7.3f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -2,28 +2,109 @@ import streamlit as st
 import random
 import fitz
 import re
+import time
 import tempfile
-from google.cloud import vision
-import openai
 from datetime import datetime
-from google.oauth2 import service_account
-from google.cloud import vision
 from data.example_sentences import example_sentences_interview
 from utilities.ui_components import button_style_2
 from data.university_department import university_department
 from utilities.process_utils import extract_subject_ranges, create_subject_dict, process_detailed_skills
-from utilities.common_utils import go_back, request_chat_completion, deduct_credit
-from utilities.github_utils import save_student_interview_data_to_github, get_submission_count, update_submission_count, load_user_database
-from utilities.logger import log_credit_transaction
+from utilities.common_utils import go_back, stream_chat_completion, request_parallel_completions, build_prompt_layout, has_credit, deduct_credit, get_credit_balance, submission_errors, report_submission_error
+from utilities.github_utils import save_student_interview_data_to_github, get_submission_count, update_submission_count, submission_transaction
+from utilities.logger import log_credit_transaction, log_token_usage
+from utilities.token_budget import get_prompt_budget, fit_prompt_to_budget
+from utilities.llm_engine import get_fallback_model, get_generation_settings
 import gc  # Import garbage collector
 
-# Set up OpenAI API
-openai.api_key = st.secrets["OpenAI"]["openai_api_key"]
-openai_client = openai.OpenAI(api_key=openai.api_key)
-
-# Set up Google Cloud Vision API
-credentials = service_account.Credentials.from_service_account_info(st.secrets["Google"]) 
-vision_client = vision.ImageAnnotatorClient(credentials=credentials)
+# Parallel section mode (project field parallel_sections: true): one short question prompt per
+# 생활기록부 section, run concurrently, then a single merge call that is streamed to the page
+INTERVIEW_SECTIONS = [
+    ("self_directed_activities", "자율활동"),
+    ("club_activities", "동아리활동"),
+    ("career_activities", "진로활동"),
+    ("first_detailed_skills", "1학년 세부능력 및 특기사항"),
+    ("second_detailed_skills", "2학년 세부능력 및 특기사항"),
+    ("third_detailed_skills", "3학년 세부능력 및 특기사항"),
+    ("behavioral_characteristics", "행동특성 및 종합의견"),
+]
+
+SECTION_PROMPT_TEMPLATE = (
+    "{university} {department}에 지원한 학생의 생활기록부 중 '{section_name}' 항목입니다. "
+    "이 항목의 내용을 근거로 대학 면접에서 나올 수 있는 예상 질문을 5개 작성해주세요. "
+    "각 질문은 '- '로 시작하는 한 줄로만 작성하세요.\n\n{section_content}"
+)
+
+MERGE_PROMPT_TEMPLATE = (
+    "다음은 {university} {department}에 지원한 학생의 생활기록부 항목별로 만든 면접 예상 질문입니다. "
+    "중복되거나 비슷한 질문은 하나로 합치고, 항목별로 정리하여 최종 면접 예상 질문 목록을 작성해주세요.\n\n{section_questions}"
+)
+
+
+def format_record_section(value):
+    """Flatten a parsed 생활기록부 section (a dict per grade or subject, a list, or text) into the text sent in the prompt."""
+    if isinstance(value, dict):
+        # "0" is the parser's placeholder for a grade missing from the record
+        return "\n".join(f"{key}: {text}" for key, text in value.items() if str(text).strip() not in ("", "0"))
+    if isinstance(value, list):
+        return "\n".join(str(text) for text in value if str(text).strip())
+    return str(value or "")
+
+
+def dedupe_questions(text, seen):
+    # Exact repeats across sections are dropped locally; the merge call only has to handle near-duplicates
+    questions = []
+    for line in text.splitlines():
+        question = line.strip().lstrip("-•").strip()
+        key = re.sub(r"\s+", "", question)
+        if question and key not in seen:
+            seen.add(key)
+            questions.append(f"- {question}")
+    return questions
+
+
+def generate_section_questions(selected_project, service_name, university, department, sections, generation_settings, deadline=None):
+    """Generate questions for every non-empty section concurrently; returns the merged question list text."""
+    section_template = selected_project.get('section_prompt_template', SECTION_PROMPT_TEMPLATE)
+    budget = get_prompt_budget(selected_project, service_name)
+    prefix = None
+    prompts = []
+    section_names = []
+    for key, section_name in INTERVIEW_SECTIONS:
+        # sections hold format_record_section text; a section with nothing in the record is skipped
+        if not sections.get(key, "").strip():
+            continue
+        (prefix, prompt), _ = fit_prompt_to_budget(
+            lambda trimmed: build_prompt_layout(
+                section_template,
+                {"university": university, "department": department, "section_name": section_name, **trimmed}
+            ),
+            {"section_content": sections[key]},
+            budget,
+            "gpt-4o-2024-08-06"
+        )
+        prompts.append(prompt)
+        section_names.append(section_name)
+
+    if not prompts:
+        return ""
+    # The section name is a variable, so every section prompt shares the same prefix
+    responses = request_parallel_completions(
+        prompts,
+        prefix=prefix,
+        model="gpt-4o-2024-08-06",
+        temperature=generation_settings["temperature"],
+        max_tokens=selected_project.get('section_max_tokens', 500),
+        deadline=deadline,
+        fallback_model=get_fallback_model(selected_project, service_name)
+    )
+
+    seen = set()
+    blocks = []
+    for section_name, response in zip(section_names, responses):
+        questions = dedupe_questions(response, seen)
+        if questions:
+            blocks.append(f"[{section_name}]\n" + "\n".join(questions))
+    return "\n\n".join(blocks)
 
 
 def enter_interview_info_page():
@@ -169,6 +250,8 @@ def enter_interview_info_page():
     ### Submit and Request API ###
     button_style_2()
     col1, col2 = st.columns(2)
+    # Created after the columns so streamed results render full-width below the buttons
+    result_container = st.container()
     submission_message = None
     error_message = None
     with col1:
@@ -176,90 +259,139 @@ def enter_interview_info_page():
             go_back()
     with col2:
         if st.button("생성하기"):
-            if not university:
-                st.error("지원하고자하는 대학을 입력해주세요.")
-            elif not department:
-                st.error("지원하고자 하는 학과를 입력해주세요.")
-            elif not uploaded_files:
-                st.error("생활기록부를 업로드해주세요.")
-            elif grade.strip() and class_num.strip() and number and name.strip() and uploaded_files is not None:
-                selected_project = st.session_state.get('selected_project')
-                user_id = st.session_state.get('teacher_user_id')
-
-                if selected_project:
-                    project_name = selected_project.get('project_name', '대학면접 예상질문 생성')
-                    submission_count = get_submission_count(user_id, grade, class_num, number, name, project_name)
-                    if submission_count >= 3:
-                        error_message = "제출 횟수가 최대 3회를 초과했습니다. 더 이상 제출할 수 없습니다."
-                    else:
-                        if deduct_credit(user_id, 10):
-                            user_database = load_user_database()
-                            user_credits_after_transaction = user_database['credentials']['user_ids'][user_id]['credit']
-                            log_credit_transaction(user_id, "decrease", 10, user_credits_after_transaction, "service_10")
-
-                            uploaded_files_bytes = b''.join([file.read() for file in uploaded_files])
-                            st.session_state['grade'] = grade.strip()
-                            st.session_state['class_num'] = class_num.strip()
-                            st.session_state['number'] = number
-                            st.session_state['name'] = name.strip()
-
-                            # Avoid saving large files in session state
-                            del st.session_state['upload_file']
-                            gc.collect()
-
-                            prompt_template_interview = selected_project.get('prompt_template', '')
-                            if prompt_template_interview:
-                                prompt = prompt_template_interview.format(
-                                    university=university,
-                                    department=department,
-                                    self_directed_activities=self_directed_activities,
-                                    club_activities=club_activities,
-                                    career_activities=career_activities,
-                                    first_detailed_skills=first_detailed_skills,
-                                    second_detailed_skills=second_detailed_skills,
-                                    third_detailed_skills=third_detailed_skills,
-                                    behavioral_characteristics=behavioral_characteristics
-                                )
-                                final_prompt = prompt
-                                if university == university and department == department:
-                                    field = university_department.get(university, {}).get(department, None)
-                                    example_questions = example_sentences_interview[field]
-                                    if len(example_questions) > 10:
-                                        example_questions = random.sample(example_questions, 10)
-                                    for example_question in example_questions:
-                                        final_prompt += f"\n- {example_question}"
-
-                                response = request_chat_completion(
-                                    final_prompt,
-                                    model="gpt-4o-2024-08-06",
-                                    stream=True,
-                                    temperature=0.0
-                                )
-                                response_text = ''.join([chunk.choices[0].delta.content if chunk.choices[0].delta.content else '' for chunk in response])
-
-                                st.session_state['gpt_response'] = response_text  
-                                submission_message = "결과물 제출이 성공적으로 완료되었습니다."
-
-                                filename = f"{user_id}_{grade}_{class_num}_{number}_{name}_{project_name}"
-                                save_student_interview_data_to_github({
-                                    "date_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                                    "grade": grade,
-                                    "class_num": class_num,
-                                    "student_number": number,
-                                    "student_name": name,
-                                    "project_name": project_name,
-                                    "gpt_response": response_text  
-                                }, filename)
-
-                                update_submission_count(user_id, grade, class_num, number, name, project_name)
-                            else:
-                                error_message = "선택된 프로젝트에 템플릿 정보가 없습니다."
+            try:
+                if not university:
+                    st.error("지원하고자하는 대학을 입력해주세요.")
+                elif not department:
+                    st.error("지원하고자 하는 학과를 입력해주세요.")
+                elif not uploaded_files:
+                    st.error("생활기록부를 업로드해주세요.")
+                elif grade.strip() and class_num.strip() and number and name.strip() and uploaded_files is not None:
+                    selected_project = st.session_state.get('selected_project')
+                    user_id = st.session_state.get('teacher_user_id')
+
+                    if selected_project:
+                        service_name = st.session_state.get('service_name')
+                        project_name = selected_project.get('project_name', '대학면접 예상질문 생성')
+                        submission_count = get_submission_count(user_id, grade, class_num, number, name, service_name, project_name)
+                        if submission_count >= 3:
+                            error_message = "제출 횟수가 최대 3회를 초과했습니다. 더 이상 제출할 수 없습니다."
                         else:
-                            error_message = "제출이 불가합니다. 선생님께 문의하시길 바랍니다."
+                            if has_credit(user_id, 10):
+                                uploaded_files_bytes = b''.join([file.read() for file in uploaded_files])
+                                st.session_state['grade'] = grade.strip()
+                                st.session_state['class_num'] = class_num.strip()
+                                st.session_state['number'] = number
+                                st.session_state['name'] = name.strip()
+
+                                # Avoid saving large files in session state
+                                del st.session_state['upload_file']
+                                gc.collect()
+
+                                prompt_template_interview = selected_project.get('prompt_template', '')
+                                if prompt_template_interview:
+                                    example_prompt = ""
+                                    if university == university and department == department:
+                                        field = university_department.get(university, {}).get(department, None)
+                                        example_questions = example_sentences_interview[field]
+                                        if len(example_questions) > 10:
+                                            # Seeded by project and field so every student of the same field shares the prompt prefix
+                                            example_questions = random.Random(f"{project_name}_{field}").sample(example_questions, 10)
+                                        for example_question in example_questions:
+                                            example_prompt += f"\n- {example_question}"
+
+                                    # Budgeted as the exact text that goes into the prompt
+                                    record_sections = {
+                                        "self_directed_activities": format_record_section(self_directed_activities),
+                                        "club_activities": format_record_section(club_activities),
+                                        "career_activities": format_record_section(career_activities),
+                                        "first_detailed_skills": format_record_section(first_detailed_skills),
+                                        "second_detailed_skills": format_record_section(second_detailed_skills),
+                                        "third_detailed_skills": format_record_section(third_detailed_skills),
+                                        "behavioral_characteristics": format_record_section(behavioral_characteristics)
+                                    }
+                                    generation_settings = get_generation_settings(selected_project)
+                                    # The section and merge calls share one time budget
+                                    deadline = time.monotonic() + generation_settings["timeout"] if generation_settings["timeout"] else None
+                                    if selected_project.get('parallel_sections', False):
+                                        with result_container:
+                                            section_questions = generate_section_questions(
+                                                selected_project, service_name, university, department,
+                                                record_sections, generation_settings, deadline
+                                            )
+                                        # Only the short merge call is streamed; its prompt is the section questions
+                                        (prefix, final_prompt), token_usage = fit_prompt_to_budget(
+                                            lambda sections: build_prompt_layout(
+                                                selected_project.get('merge_prompt_template', MERGE_PROMPT_TEMPLATE),
+                                                {"university": university, "department": department, **sections},
+                                                static_suffix=example_prompt
+                                            ),
+                                            {"section_questions": section_questions},
+                                            get_prompt_budget(selected_project, service_name),
+                                            "gpt-4o-2024-08-06"
+                                        )
+                                    else:
+                                        # Long 생활기록부 sections are trimmed evenly so the prompt stays within the service budget
+                                        (prefix, final_prompt), token_usage = fit_prompt_to_budget(
+                                            lambda sections: build_prompt_layout(
+                                                prompt_template_interview,
+                                                {"university": university, "department": department, **sections},
+                                                static_suffix=example_prompt
+                                            ),
+                                            record_sections,
+                                            get_prompt_budget(selected_project, service_name),
+                                            "gpt-4o-2024-08-06"
+                                        )
+                                    log_token_usage(user_id, service_name, project_name, "gpt-4o-2024-08-06", token_usage)
+
+                                    with result_container:
+                                        response_text = st.write_stream(stream_chat_completion(
+                                            final_prompt,
+                                            prefix=prefix,
+                                            model="gpt-4o-2024-08-06",
+                                            temperature=generation_settings["temperature"],
+                                            max_tokens=generation_settings["max_tokens"],
+                                            deadline=deadline,
+                                            cache_namespace=f"{user_id}_{service_name}_{project_name}",
+                                            prompt_template=prompt_template_interview,
+                                            fallback_model=get_fallback_model(selected_project, service_name)
+                                        ))
+
+                                    st.session_state['gpt_response'] = response_text  
+
+                                    # Credit, submission record and count are committed together
+                                    filename = f"{user_id}_{grade}_{class_num}_{number}_{name}_{project_name}"
+                                    with submission_transaction(f"Add student submission {filename}"):
+                                        credit_deducted = deduct_credit(user_id, 10)
+                                        if credit_deducted:
+                                            save_student_interview_data_to_github({
+                                                "date_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                                                "grade": grade,
+                                                "class_num": class_num,
+                                                "student_number": number,
+                                                "student_name": name,
+                                                "project_name": project_name,
+                                                "gpt_response": response_text  
+                                            }, filename)
+
+                                            update_submission_count(user_id, grade, class_num, number, name, service_name, project_name)
+
+                                    if credit_deducted:
+                                        user_credits_after_transaction = get_credit_balance(user_id)
+                                        log_credit_transaction(user_id, "decrease", 10, user_credits_after_transaction, "service_10")
+                                        submission_message = "결과물 제출이 성공적으로 완료되었습니다."
+                                    else:
+                                        error_message = "제출이 불가합니다. 선생님께 문의하시길 바랍니다."
+                                else:
+                                    error_message = "선택된 프로젝트에 템플릿 정보가 없습니다."
+                            else:
+                                error_message = "제출이 불가합니다. 선생님께 문의하시길 바랍니다."
+                    else:
+                        error_message = "선택된 프로젝트 정보가 없습니다."
                 else:
-                    error_message = "선택된 프로젝트 정보가 없습니다."
-            else:
-                error_message = "학년, 반, 번호, 이름을 모두 입력하고 결과물 이미지를 업로드해주세요."
+                    error_message = "학년, 반, 번호, 이름을 모두 입력하고 결과물 이미지를 업로드해주세요."
+            except submission_errors as e:
+                error_message = report_submission_error(e, "gpt-4o-2024-08-06")
 
     if submission_message:
         st.success(submission_message)
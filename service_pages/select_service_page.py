@@ -1,15 +1,14 @@
 import streamlit as st
 from utilities.ui_components import button_style_2
 from utilities.common_utils import set_page
-from utilities.github_utils import load_yaml_from_github
+from utilities.github_utils import load_yamls_from_github
 
 
 def select_service_page():
     if st.session_state['pin_verified']:
         teacher_name = st.session_state.get('teacher_name')
         teacher_user_id = st.session_state.get('teacher_user_id')
-        user_database = load_yaml_from_github('user_database.yaml')
-        project_database = load_yaml_from_github('project_database.yaml')
+        user_database, project_database = load_yamls_from_github('user_database.yaml', 'project_database.yaml')
 
         st.markdown(f"""
             <div style='font-size:35px; font-weight:bold;'>
@@ -8,12 +8,14 @@ from datetime import datetime
 import pillow_heif
 from utilities.ui_components import button_style_2
 from pdf2image import convert_from_bytes
-from utilities.process_utils import extract_text_from_pdf, convert_image_to_pdf_bytes
-from utilities.common_utils import go_back, request_chat_completion, deduct_credit
-from utilities.github_utils import save_student_text_data_to_github, get_submission_count, update_submission_count, load_user_database
-from utilities.logger import log_credit_transaction
+from utilities.process_utils import extract_text_from_uploads
+from utilities.common_utils import go_back, stream_chat_completion, build_prompt_layout, has_credit, deduct_credit, get_credit_balance, submission_errors, report_submission_error
+from utilities.github_utils import save_student_text_data_to_github, get_submission_count, update_submission_count, submission_transaction
+from utilities.logger import log_credit_transaction, log_token_usage
+from utilities.token_budget import get_prompt_budget, fit_prompt_to_budget
+from utilities.llm_engine import get_fallback_model, get_generation_settings
+from utilities.batch_grading import queue_batch_submission
 
-LOCK_FILE = 'submission_lock.lock'
 PREVIEW_COUNT_FILE = 'preview_count.txt'
 PREVIEW_LOCK_FILE = 'preview_lock.lock'
 MAX_PREVIEW_USERS = 10  # Maximum number of simultaneous users
@@ -29,27 +31,6 @@ def initialize_preview_slots():
 # Initialize the preview slots when starting the application
 initialize_preview_slots()
 
-# Acquire lock for critical sections
-async def acquire_lock(lock_file):
-    while True:
-        try:
-            fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
-            os.close(fd)
-            return True
-        except OSError as e:
-            if e.errno == errno.EEXIST:
-                await asyncio.sleep(0.1)  # Wait before retrying
-            else:
-                raise
-
-# Release lock after finishing critical sections
-async def release_lock(lock_file):
-    try:
-        if os.path.exists(lock_file):
-            os.remove(lock_file)  # Ensure the lock is removed after use
-    except OSError as e:
-        print(f"Error releasing lock: {e}")  # Add error handling if lock removal fails
-
 # Acquire preview slot (manage concurrent users)
 async def acquire_preview_slot():
     while True:
@@ -168,6 +149,8 @@ async def upload_text_evaluation_page():
 
     button_style_2()
     col1, col2 = st.columns(2)
+    # Created after the columns so streamed results render full-width below the buttons
+    result_container = st.container()
     with col1:
         if st.button("뒤로가기"):
             if st.session_state.get('preview_slot_acquired', False):
@@ -176,91 +159,122 @@ async def upload_text_evaluation_page():
             go_back()
     with col2:
         if st.button("제출하기"):
-            if not await acquire_lock(LOCK_FILE):
-                error_message = "현재 제출자가 많아 잠시후 다시 제출하길 바랍니다."
-            else:
-                try:
-                    content = ""
-                    for uploaded_file in uploaded_files:
-                        file_type = uploaded_file.type
-                        if file_type == "application/pdf":
-                            processed_pdf_bytes = uploaded_file.read()
-                            content += extract_text_from_pdf(BytesIO(processed_pdf_bytes))
+            # No global lock: generations run concurrently under the engine's rate limits,
+            # and only the final persistence step is serialised by submission_transaction
+            try:
+                # Every file of the upload is extracted together so images and scanned pages share OCR batches;
+                # photos go to OCR as decoded images, without a round trip through PDF
+                sources = []
+                for uploaded_file in uploaded_files:
+                    file_type = uploaded_file.type
+                    if file_type == "application/pdf":
+                        sources.append(BytesIO(uploaded_file.read()))
+                    else:
+                        if file_type == "image/heic":
+                            heif_file = pillow_heif.open_heif(uploaded_file)
+                            image = heif_file.convert("RGB")
                         else:
-                            if file_type == "image/heic":
-                                heif_file = pillow_heif.open_heif(uploaded_file)
-                                image = heif_file.convert("RGB")
-                            else:
-                                image = Image.open(uploaded_file)
-                            processed_pdf_bytes = convert_image_to_pdf_bytes(image)
-                            content += extract_text_from_pdf(BytesIO(processed_pdf_bytes))
-
-                    if grade.strip() and class_num.strip() and number and name.strip() and content:
-                        selected_project = st.session_state.get('selected_project')
-                        if selected_project:
-                            service_name = st.session_state.get('service_name')
-                            project_name = selected_project.get('project_name')
-                            user_id = st.session_state.get('teacher_user_id')
-
-                            submission_count = get_submission_count(user_id, grade, class_num, number, name, service_name, project_name) 
-                            if submission_count >= 3:
-                                error_message = "제출 횟수가 최대 3회를 초과했습니다. 더 이상 제출할 수 없습니다."
-                            else:
-                                if deduct_credit(user_id, 5):  
-                                    user_database = load_user_database()
-                                    user_credits_after_transaction = user_database['credentials']['user_ids'][user_id]['credit']
-                                    log_credit_transaction(user_id, "decrease", 5, user_credits_after_transaction, "upload_text_evaluation_page")
+                            image = Image.open(uploaded_file)
+                        sources.append(image)
+                content = extract_text_from_uploads(sources)
 
-                                    submission_message = "결과물 제출이 성공적으로 완료되었습니다."
+                if grade.strip() and class_num.strip() and number and name.strip() and content:
+                    selected_project = st.session_state.get('selected_project')
+                    if selected_project:
+                        service_name = st.session_state.get('service_name')
+                        project_name = selected_project.get('project_name')
+                        user_id = st.session_state.get('teacher_user_id')
 
-                                    st.session_state['grade'] = grade.strip()
-                                    st.session_state['class_num'] = class_num.strip()
-                                    st.session_state['number'] = number
-                                    st.session_state['name'] = name.strip()
-                                    st.session_state['extracted_text'] = content 
+                        submission_count = get_submission_count(user_id, grade, class_num, number, name, service_name, project_name) 
+                        if submission_count >= 3:
+                            error_message = "제출 횟수가 최대 3회를 초과했습니다. 더 이상 제출할 수 없습니다."
+                        else:
+                            if has_credit(user_id, 5):
+                                st.session_state['grade'] = grade.strip()
+                                st.session_state['class_num'] = class_num.strip()
+                                st.session_state['number'] = number
+                                st.session_state['name'] = name.strip()
+                                st.session_state['extracted_text'] = content 
 
-                                    prompt_template_text = selected_project.get('prompt_template', '')
-                                    if prompt_template_text:
-                                        prompt = prompt_template_text.format(content=content)
-                                        
-                                        response = request_chat_completion(
-                                            prompt, 
-                                            model="gpt-4o-2024-08-06",  
-                                            stream=True, 
-                                            temperature=0.0
+                                prompt_template_text = selected_project.get('prompt_template', '')
+                                if prompt_template_text:
+                                    # Batch-mode projects are graded later in one bulk job (utilities/batch_grading.py)
+                                    batch_mode = selected_project.get('batch_mode', False)
+                                    if batch_mode:
+                                        response_text = ""
+                                    else:
+                                        (prefix, prompt), token_usage = fit_prompt_to_budget(
+                                            lambda sections: build_prompt_layout(prompt_template_text, sections),
+                                            {"content": content},
+                                            get_prompt_budget(selected_project, service_name),
+                                            "gpt-4o-2024-08-06"
                                         )
-                                        response_text = ''.join([chunk.choices[0].delta.content if chunk.choices[0].delta.content else '' for chunk in response])
+                                        log_token_usage(user_id, service_name, project_name, "gpt-4o-2024-08-06", token_usage)
+                                        
+                                        generation_settings = get_generation_settings(selected_project)
+                                        with result_container:
+                                            response_text = st.write_stream(stream_chat_completion(
+                                                prompt, 
+                                                prefix=prefix,
+                                                model="gpt-4o-2024-08-06",  
+                                                temperature=generation_settings["temperature"],
+                                                max_tokens=generation_settings["max_tokens"],
+                                                timeout=generation_settings["timeout"],
+                                                cache_namespace=f"{user_id}_{service_name}_{project_name}",
+                                                prompt_template=prompt_template_text,
+                                                fallback_model=get_fallback_model(selected_project, service_name)
+                                            ))
 
-                                        st.session_state['gpt_response'] = response_text  
+                                    st.session_state['gpt_response'] = response_text  
 
-                                        filename = f"{user_id}_{grade}_{class_num}_{number}_{name}_{service_name}_{project_name}"
-                                        save_student_text_data_to_github({
-                                            "teacher": user_id,
-                                            "date_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                                            "grade": grade,  
-                                            "class_num": class_num,
-                                            "student_number": number,
-                                            "student_name": name,
-                                            "service_name": service_name,
-                                            "project_name": project_name, 
-                                            "extracted_text": content,
-                                            "gpt_response": response_text,  
-                                        }, filename) 
-                                        
-                                        update_submission_count(user_id, grade, class_num, number, name, service_name, project_name)
+                                    # Credit, submission record and count are committed together
+                                    filename = f"{user_id}_{grade}_{class_num}_{number}_{name}_{service_name}_{project_name}"
+                                    with submission_transaction(f"Add student submission {filename}"):
+                                        credit_deducted = deduct_credit(user_id, 5)
+                                        if credit_deducted:
+                                            submission_data = {
+                                                "teacher": user_id,
+                                                "date_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                                                "grade": grade,  
+                                                "class_num": class_num,
+                                                "student_number": number,
+                                                "student_name": name,
+                                                "service_name": service_name,
+                                                "project_name": project_name, 
+                                                "extracted_text": content,
+                                                "gpt_response": response_text,  
+                                            }
+                                            if batch_mode:
+                                                submission_data["status"] = "pending_batch"
+                                            save_student_text_data_to_github(submission_data, filename) 
+                                            if batch_mode:
+                                                queue_batch_submission(user_id, service_name, project_name, filename)
+                                            
+                                            update_submission_count(user_id, grade, class_num, number, name, service_name, project_name)
+
+                                    if credit_deducted:
+                                        user_credits_after_transaction = get_credit_balance(user_id)
+                                        log_credit_transaction(user_id, "decrease", 5, user_credits_after_transaction, "upload_text_evaluation_page")
+                                        if batch_mode:
+                                            submission_message = "결과물 제출이 완료되었습니다. 채점 결과는 일괄 처리 후 선생님께 전달됩니다."
+                                        else:
+                                            submission_message = "결과물 제출이 성공적으로 완료되었습니다."
                                     else:
-                                        error_message = "선택된 프로젝트에 템플릿 정보가 없습니다."
+                                        error_message = "제출이 불가합니다. 선생님께 문의하시길 바랍니다."
                                 else:
-                                    error_message = "제출이 불가합니다. 선생님께 문의하시길 바랍니다."
-                        else:
-                            error_message = "선택된 프로젝트 정보가 없습니다."
+                                    error_message = "선택된 프로젝트에 템플릿 정보가 없습니다."
+                            else:
+                                error_message = "제출이 불가합니다. 선생님께 문의하시길 바랍니다."
                     else:
-                        error_message = "학년, 반, 번호, 이름을 모두 입력하고 결과물 이미지를 업로드해주세요."
-                finally:
-                    await release_lock(LOCK_FILE)
-                    if st.session_state.get('preview_slot_acquired', False):
-                        await release_preview_slot()
-                        st.session_state['preview_slot_acquired'] = False
+                        error_message = "선택된 프로젝트 정보가 없습니다."
+                else:
+                    error_message = "학년, 반, 번호, 이름을 모두 입력하고 결과물 이미지를 업로드해주세요."
+            except submission_errors as e:
+                error_message = report_submission_error(e, "gpt-4o-2024-08-06")
+            finally:
+                if st.session_state.get('preview_slot_acquired', False):
+                    await release_preview_slot()
+                    st.session_state['preview_slot_acquired'] = False
 
     if submission_message:
         st.success(submission_message)
@@ -1,7 +1,7 @@
 import streamlit as st
 from utilities.ui_components import button_style_2
 from utilities.common_utils import set_page
-from utilities.github_utils import load_yaml_from_github
+from utilities.github_utils import load_yamls_from_github
 
 def verify_pin_page():
     if 'pin_verified' not in st.session_state:
@@ -13,8 +13,7 @@ def verify_pin_page():
         pin_input = st.text_input("선생님의 PIN 번호 6자리를 입력하세요.", type="password", max_chars=6)
 
         if st.button("확인"):
-            user_database = load_yaml_from_github('user_database.yaml')
-            project_database = load_yaml_from_github('project_database.yaml')
+            user_database, project_database = load_yamls_from_github('user_database.yaml', 'project_database.yaml')
             if user_database:
                 found_user_id = None
                 for teacher_user_id, user_info in user_database.get('credentials', {}).get('user_ids', {}).items():
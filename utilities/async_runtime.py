@@ -0,0 +1,40 @@
+import asyncio
+import threading
+
+# ===============================*** Background Event Loop ***===============================
+
+# Streamlit reruns every script in a fresh asyncio.run(), so long-lived async clients
+# (and their connection pools) live on one background loop shared by the whole process.
+background_loop = None
+background_loop_lock = threading.Lock()
+
+
+def get_background_loop():
+    global background_loop
+    with background_loop_lock:
+        if background_loop is None:
+            background_loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=background_loop.run_forever, daemon=True)
+            thread.start()
+    return background_loop
+
+
+def submit_async(coro):
+    """Schedule a coroutine on the background loop and return a concurrent.futures.Future."""
+    return asyncio.run_coroutine_threadsafe(coro, get_background_loop())
+
+
+def run_async(coro, timeout=None):
+    """Run a coroutine on the background loop and block until it finishes."""
+    return submit_async(coro).result(timeout)
+
+
+async def gather_async(*coros):
+    """asyncio.gather that cancels the remaining coroutines as soon as one of them fails."""
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
@@ -0,0 +1,224 @@
+import io
+import sys
+import json
+import uuid
+import argparse
+import datetime
+import streamlit as st
+from utilities.clients import get_openai_client
+from utilities.storage import read_file, write_file, list_files
+from utilities.common_utils import build_messages, build_prompt_layout
+from utilities.token_budget import get_prompt_budget, fit_prompt_to_budget
+from utilities.llm_engine import get_generation_settings
+from utilities.github_utils import load_yaml_from_github, save_student_text_data_to_github, submission_transaction
+
+# ===============================*** Setup Configuration ***===============================
+
+# Batch grading settings (optional [BatchGrading] section in secrets.toml)
+batch_settings = st.secrets.get("BatchGrading", {})
+batch_client_name = batch_settings.get("client", "openai")  # "openai" or "local"
+batch_model = batch_settings.get("model", "gpt-4o-2024-08-06")
+batch_completion_window = batch_settings.get("completion_window", "24h")
+
+BATCH_QUEUE_DIR = "batch_queue"
+BATCH_JOB_DIR = "batch_jobs"
+LOCAL_BATCH_DIR = "batch_local_results"
+
+# ===============================*** Batch Clients ***===============================
+
+class OpenAIBatchClient:
+    """Submits chat completion requests through the OpenAI Batch API."""
+
+    def create_batch(self, requests):
+        client = get_openai_client()
+        jsonl = "\n".join(json.dumps(request, ensure_ascii=False) for request in requests) + "\n"
+        input_file = client.files.create(file=("batch_input.jsonl", io.BytesIO(jsonl.encode("utf-8"))), purpose="batch")
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=batch_completion_window
+        )
+        return batch.id
+
+    def get_results(self, batch_id):
+        """Return {custom_id: (content or None, error or None)} once the batch has ended, otherwise None."""
+        client = get_openai_client()
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in ("validating", "in_progress", "finalizing", "cancelling"):
+            return None
+
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in client.files.content(file_id).text.splitlines():
+                if line.strip():
+                    custom_id, content, error = parse_batch_output_line(json.loads(line))
+                    results[custom_id] = (content, error)
+        return results
+
+
+class LocalBatchClient:
+    """Offline stand-in for tests and local runs: answers every request immediately with a canned response.
+
+    The responses are kept in storage, so a collect run in another process finds the batch.
+    """
+
+    def create_batch(self, requests):
+        batch_id = f"local_batch_{uuid.uuid4().hex}"
+        results = {
+            request["custom_id"]: [f"[local batch response] {request['body']['messages'][-1]['content'][:100]}", None]
+            for request in requests
+        }
+        write_file(f"{LOCAL_BATCH_DIR}/{batch_id}.json", json.dumps(results, indent=4, ensure_ascii=False), "Record local batch results")
+        return batch_id
+
+    def get_results(self, batch_id):
+        # An unknown batch is treated like one still running: the job stays pending
+        results = load_json_file(f"{LOCAL_BATCH_DIR}/{batch_id}.json", None)
+        if results is None:
+            return None
+        return {custom_id: tuple(result) for custom_id, result in results.items()}
+
+
+def parse_batch_output_line(record):
+    response = record.get("response") or {}
+    if record.get("error") or response.get("status_code") != 200:
+        return record["custom_id"], None, json.dumps(record.get("error") or response.get("body"), ensure_ascii=False)
+    return record["custom_id"], response["body"]["choices"][0]["message"]["content"], None
+
+
+batch_client = LocalBatchClient() if batch_client_name == "local" else OpenAIBatchClient()
+
+# ===============================*** Pending Submission Queue ***===============================
+
+def get_batch_queue_path(user_id, service_name, project_name):
+    return f"{BATCH_QUEUE_DIR}/{user_id}/{service_name}_{project_name}.json"
+
+def get_batch_job_dir(user_id, service_name, project_name):
+    return f"{BATCH_JOB_DIR}/{user_id}/{service_name}_{project_name}/"
+
+def load_json_file(file_path, default):
+    content = read_file(file_path)
+    return json.loads(content) if content else default
+
+def queue_batch_submission(user_id, service_name, project_name, filename):
+    # Called inside the submission's transaction, so the record and its queue entry commit together
+    queue_path = get_batch_queue_path(user_id, service_name, project_name)
+    pending = load_json_file(queue_path, [])
+    if filename not in pending:
+        pending.append(filename)
+    write_file(queue_path, json.dumps(pending, indent=4, ensure_ascii=False), "Queue submission for batch grading")
+
+# ===============================*** Batch Submission and Collection ***===============================
+
+def find_project(user_id, service_name, project_name):
+    project_database = load_yaml_from_github('project_database.yaml') or {}
+    return next(
+        (project for project in project_database.get('projects', [])
+         if project.get('creator') == user_id
+         and project.get('service_name') == service_name
+         and project.get('project_name') == project_name),
+        None
+    )
+
+def submit_batch(user_id, service_name, project_name):
+    """Send every pending submission of a project as one batch job; returns the batch id or None."""
+    project = find_project(user_id, service_name, project_name)
+    if not project or not project.get('prompt_template'):
+        raise ValueError(f"Project not found or has no prompt_template: {service_name} // {project_name}")
+
+    queue_path = get_batch_queue_path(user_id, service_name, project_name)
+    pending = load_json_file(queue_path, [])
+    if not pending:
+        return None
+
+    generation_settings = get_generation_settings(project)
+    requests = []
+    for filename in pending:
+        submission = load_yaml_from_github(f"submissions/{filename}.yaml")
+        if not submission:
+            continue
+        (prefix, prompt), _ = fit_prompt_to_budget(
+            lambda sections: build_prompt_layout(project['prompt_template'], sections),
+            {"content": submission.get('extracted_text', '')},
+            get_prompt_budget(project, service_name),
+            batch_model
+        )
+        body = {
+            "model": batch_model,
+            "messages": build_messages(prompt, prefix=prefix),
+            "temperature": generation_settings["temperature"],
+        }
+        if generation_settings["max_tokens"]:
+            body["max_tokens"] = generation_settings["max_tokens"]
+        requests.append({"custom_id": filename, "method": "POST", "url": "/v1/chat/completions", "body": body})
+    if not requests:
+        return None
+
+    batch_id = batch_client.create_batch(requests)
+    job = {
+        "batch_id": batch_id,
+        "status": "submitted",
+        "submitted_at": datetime.datetime.now().isoformat(),
+        "filenames": [request["custom_id"] for request in requests],
+    }
+    with submission_transaction(f"Submit batch grading job {batch_id}"):
+        write_file(f"{get_batch_job_dir(user_id, service_name, project_name)}{batch_id}.json",
+                   json.dumps(job, indent=4, ensure_ascii=False), "Record batch grading job")
+        # Submissions queued while the batch was being built stay pending
+        remaining = [filename for filename in load_json_file(queue_path, []) if filename not in job["filenames"]]
+        write_file(queue_path, json.dumps(remaining, indent=4, ensure_ascii=False), "Dequeue submissions sent for batch grading")
+    return batch_id
+
+def collect_batch_results(user_id, service_name, project_name):
+    """Write the results of finished batch jobs back into each submission record; returns the number updated."""
+    updated = 0
+    for job_path in list_files(get_batch_job_dir(user_id, service_name, project_name)):
+        job = load_json_file(job_path, None)
+        if not job or job["status"] != "submitted":
+            continue
+        results = batch_client.get_results(job["batch_id"])
+        if results is None:
+            continue
+
+        with submission_transaction(f"Collect batch grading job {job['batch_id']}"):
+            for filename in job["filenames"]:
+                submission = load_yaml_from_github(f"submissions/{filename}.yaml")
+                if not submission:
+                    continue
+                content, error = results.get(filename, (None, "missing from batch output"))
+                if content is not None:
+                    submission["gpt_response"] = content
+                    submission["status"] = "completed"
+                    updated += 1
+                else:
+                    submission["status"] = "failed"
+                    submission["batch_error"] = error
+                submission["batch_id"] = job["batch_id"]
+                save_student_text_data_to_github(submission, filename)
+            job["status"] = "completed"
+            job["collected_at"] = datetime.datetime.now().isoformat()
+            write_file(job_path, json.dumps(job, indent=4, ensure_ascii=False), "Complete batch grading job")
+    return updated
+
+# ===============================*** Command Line ***===============================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch grading for 수행평가 채점 projects")
+    parser.add_argument("action", choices=["submit", "collect"])
+    parser.add_argument("user_id")
+    parser.add_argument("service_name")
+    parser.add_argument("project_name")
+    args = parser.parse_args(argv)
+
+    if args.action == "submit":
+        batch_id = submit_batch(args.user_id, args.service_name, args.project_name)
+        print(f"Submitted batch {batch_id}" if batch_id else "No pending submissions")
+    else:
+        updated = collect_batch_results(args.user_id, args.service_name, args.project_name)
+        print(f"Updated {updated} submissions")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,64 @@
+import threading
+import streamlit as st
+import openai
+from google.cloud import vision
+from google.oauth2 import service_account
+from utilities.github_client import AsyncGitHubClient
+
+# ===============================*** Setup Configuration ***===============================
+
+# GitHub Repository Details
+github_user = "Team-EduChange"
+github_repo = "Data_Base"
+github_branch = "main"
+
+# ===============================*** Shared Client Registry ***===============================
+
+# Every client is built once per process, on first use, and shared by all modules and sessions
+clients = {}
+clients_lock = threading.Lock()
+
+
+def get_client(name, factory):
+    client = clients.get(name)
+    if client is None:
+        with clients_lock:
+            client = clients.get(name)
+            if client is None:
+                client = factory()
+                clients[name] = client
+    return client
+
+
+def create_github_client():
+    return AsyncGitHubClient(st.secrets["Github"]["github_token"], github_user, github_repo, github_branch)
+
+
+def create_openai_client():
+    return openai.OpenAI(api_key=st.secrets["OpenAI"]["openai_api_key"])
+
+
+def create_async_openai_client():
+    # Only used from the background event loop (utilities/async_runtime), which owns its connection pool
+    return openai.AsyncOpenAI(api_key=st.secrets["OpenAI"]["openai_api_key"])
+
+
+def create_vision_client():
+    credentials = service_account.Credentials.from_service_account_info(st.secrets["Google"])
+    return vision.ImageAnnotatorClient(credentials=credentials)
+
+
+def get_github_client():
+    return get_client("github", create_github_client)
+
+
+def get_openai_client():
+    return get_client("openai", create_openai_client)
+
+
+def get_async_openai_client():
+    return get_client("async_openai", create_async_openai_client)
+
+
+def get_vision_client():
+    return get_client("vision", create_vision_client)
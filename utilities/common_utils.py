@@ -1,64 +1,230 @@
-import streamlit as st
+import json
+import datetime
 import openai
-from utilities.github_utils import load_yaml_from_github, save_yaml_to_github
-
-# ===============================*** Setup Configuration ***===============================
-
-# Set up OpenAI API
-openai.api_key = st.secrets["OpenAI"]["openai_api_key"]
-openai_client = openai.OpenAI(api_key=openai.api_key)
-
+import streamlit as st
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from utilities.storage import read_file, append_file, storage_errors
+from utilities.github_utils import load_yaml_from_github
+from utilities.logger import log_generation_truncated, log_generation_timeout, log_generation_failure
+from utilities.llm_engine import stream_completion, complete_parallel, get_generation_settings, GenerationTimeoutError, GenerationCancelledError, CircuitOpenError
+from utilities.llm_cache import llm_cache_enabled, make_cache_key, sync_namespace_template, get_cached_response, store_response
 
 # ===============================*** Page Navigation Functions ***===============================
 
 def set_page(page_name):
+    cancel_active_stream()
     st.session_state['page_history'].append(st.session_state['page'])
     st.session_state['page'] = page_name
     st.rerun()  
 
 def go_back():
+    cancel_active_stream()
     if st.session_state['page_history']:
         st.session_state['page'] = st.session_state['page_history'].pop()
         st.rerun()  
 
 # ===============================*** OpenAI Integration Functions ***===============================
 
-def request_chat_completion(prompt, 
-                            system_role="You are a helpful assistant.", 
-                            model="gpt-3.5-turbo",
-                            temperature=0.0,
-                            stream=False):
-    messages = [
+def build_messages(prompt, system_role="You are a helpful assistant.", prefix=None):
+    # The system message is the static part of the request, so the provider can cache it as a shared prefix
+    system_content = f"{system_role}\n\n{prefix}" if prefix else system_role
+    return [
+        {"role": "system", "content": system_content},
         {"role": "user", "content": prompt}
     ]
-    response = openai_client.chat.completions.create(
-        model=model,
-        messages=messages,
-        stream=stream
-    )
-    return response
+
+def build_prompt_layout(prompt_template, variables, static_suffix=""):
+    """Split a project prompt into a prefix identical for every student of the project and the per-student prompt.
+
+    Placeholders in the template become labels such as [content], and the values follow in the prompt under the same labels.
+    """
+    prefix = prompt_template.format(**{name: f"[{name}]" for name in variables}) + static_suffix
+    prompt = "\n\n".join(f"[{name}]\n{value}" for name, value in variables.items())
+    return prefix, prompt
+
+# ===============================*** Session-bound Streaming ***===============================
+
+def cancel_active_stream():
+    # A run interrupted mid-generation may not have closed its stream yet; the next run of the session stops it
+    future = st.session_state.pop('active_llm_future', None)
+    if future is not None:
+        future.cancel()
+
+def track_active_stream(future):
+    cancel_active_stream()
+    st.session_state['active_llm_future'] = future
+
+def make_session_watcher():
+    """Return a should_cancel callback tied to the current page run, plus a function that marks the first output."""
+    ctx = get_script_run_ctx()
+    if ctx is None or not runtime.exists():
+        return None, lambda: None
+    session_runtime = runtime.get_instance()
+    state = {"placeholder": None, "started": False}
+
+    def should_cancel():
+        # Updating an element is a Streamlit interrupt point: a pending stop or rerun
+        # (뒤로가기 pressed, page closed) is raised here instead of after the generation
+        if state["placeholder"] is None:
+            state["placeholder"] = st.empty()
+        if state["started"]:
+            state["placeholder"].empty()
+        else:
+            state["placeholder"].caption("응답을 생성하는 중입니다...")
+        return not session_runtime.is_active_session(ctx.session_id)
+
+    def mark_started():
+        if not state["started"]:
+            state["started"] = True
+            if state["placeholder"] is not None:
+                state["placeholder"].empty()
+
+    return should_cancel, mark_started
+
+def stream_chat_completion(prompt,
+                           system_role="You are a helpful assistant.",
+                           model="gpt-3.5-turbo",
+                           temperature=0.0,
+                           cache_namespace=None,
+                           prompt_template=None,
+                           fallback_model=None,
+                           prefix=None,
+                           max_tokens=None,
+                           timeout=None,
+                           deadline=None):
+    """Yield the response text piece by piece; identical requests within cache_namespace are served from the response cache.
+
+    A generation still running after timeout seconds (or at deadline) is cancelled with GenerationTimeoutError.
+    """
+    params = {"temperature": temperature}
+    if max_tokens:
+        params["max_tokens"] = max_tokens
+
+    cache_key = None
+    if llm_cache_enabled and cache_namespace:
+        sync_namespace_template(cache_namespace, prompt_template)
+        cache_key = make_cache_key(model, build_messages(prompt, system_role, prefix), params)
+        cached_response = get_cached_response(cache_key)
+        if cached_response is not None:
+            yield cached_response
+            return
+
+    # Runs on the shared async engine, rate-limited by account-wide request and token buckets,
+    # and is cancelled as soon as the session that asked for it goes away
+    should_cancel, mark_started = make_session_watcher()
+    pieces = []
+    finish_reason = None
+    response_model = model
+    for piece, chunk_finish_reason, response_model in stream_completion(
+        model,
+        build_messages(prompt, system_role, prefix),
+        fallback_model=fallback_model,
+        timeout=timeout,
+        should_cancel=should_cancel,
+        on_submit=track_active_stream,
+        deadline=deadline,
+        **params
+    ):
+        finish_reason = chunk_finish_reason or finish_reason
+        if piece:
+            mark_started()
+            pieces.append(piece)
+            yield piece
+
+    if finish_reason == "length":
+        log_generation_truncated(st.session_state.get('teacher_user_id'), response_model, max_tokens, cache_namespace)
+        st.warning("응답이 최대 길이에 도달해 끝부분이 잘렸습니다.")
+    # Truncated or interrupted generations are not worth replaying, nor are fallback answers under the primary model's key
+    if cache_key and finish_reason == "stop" and response_model == model:
+        store_response(cache_key, cache_namespace, ''.join(pieces))
+
+def request_parallel_completions(prompts,
+                                 system_role="You are a helpful assistant.",
+                                 model="gpt-3.5-turbo",
+                                 temperature=0.0,
+                                 fallback_model=None,
+                                 prefix=None,
+                                 max_tokens=None,
+                                 timeout=None,
+                                 deadline=None):
+    """Generate a response for every prompt concurrently (all sharing prefix) and return them in order."""
+    params = {"temperature": temperature}
+    if max_tokens:
+        params["max_tokens"] = max_tokens
+    should_cancel, mark_started = make_session_watcher()
+    try:
+        return complete_parallel(
+            model,
+            [build_messages(prompt, system_role, prefix) for prompt in prompts],
+            fallback_model=fallback_model,
+            timeout=timeout,
+            should_cancel=should_cancel,
+            on_submit=track_active_stream,
+            deadline=deadline,
+            **params
+        )
+    finally:
+        # Nothing streams here, so the waiting caption goes once the whole group is done
+        mark_started()
+
+# Failures a service page reports to the user instead of crashing
+submission_errors = (GenerationTimeoutError, GenerationCancelledError, CircuitOpenError, openai.APIError) + storage_errors
+
+def report_submission_error(error, model):
+    """Log a failed submission of the current page run and return the message to show for it."""
+    user_id = st.session_state.get('teacher_user_id')
+    service_name = st.session_state.get('service_name')
+    selected_project = st.session_state.get('selected_project') or {}
+    project_name = selected_project.get('project_name')
+    if isinstance(error, GenerationTimeoutError):
+        # The SLO cancelled the generation before anything was saved or charged
+        log_generation_timeout(user_id, service_name, project_name, model, get_generation_settings(selected_project)["timeout"])
+        return "응답 생성 시간이 초과되었습니다. 잠시 후 다시 시도해주세요."
+    log_generation_failure(user_id, service_name, project_name, model, error)
+    if isinstance(error, GenerationCancelledError):
+        # The session stopped waiting for the response
+        return "응답 생성이 중단되었습니다. 다시 시도해주세요."
+    if isinstance(error, (CircuitOpenError, openai.APIError)):
+        # Retries and the fallback model were exhausted
+        return "응답 생성 중 오류가 발생했습니다. 잠시 후 다시 시도해주세요."
+    # Reading or saving the submission failed; a failed submission transaction leaves nothing saved or charged
+    return "제출 내용을 저장하는 중 오류가 발생했습니다. 잠시 후 다시 시도해주세요."
 
 # ===============================*** User Management Functions ***===============================
 
-def deduct_credit(user_id, amount):
-    user_database = load_yaml_from_github('user_database.yaml') 
-    if not user_database:
-        st.error("Failed to load user database.")
-        return False
+# Credit is granted by raising the credit field of user_database.yaml on GitHub; what the app spends goes
+# to a per-user ledger of deltas in local storage, replicated like submissions, so no submission waits on GitHub
+CREDIT_LEDGER_DIR = "credit_ledger"
+
+def get_credit_ledger_path(user_id):
+    return f"{CREDIT_LEDGER_DIR}/{user_id}.jsonl"
 
+def get_credit_balance(user_id):
+    """Credit granted in user_database.yaml plus the ledger's deltas, or None for an unknown user."""
+    user_database = load_yaml_from_github('user_database.yaml')
+    if not user_database:
+        return None
     user_info = user_database.get('credentials', {}).get('user_ids', {}).get(user_id, None)
-    
     if not user_info:
+        return None
+    ledger = read_file(get_credit_ledger_path(user_id)) or ""
+    return user_info.get('credit', 0) + sum(json.loads(line)["amount"] for line in ledger.splitlines() if line.strip())
+
+def has_credit(user_id, amount):
+    balance = get_credit_balance(user_id)
+    return balance is not None and balance >= amount
+
+def deduct_credit(user_id, amount):
+    balance = get_credit_balance(user_id)
+    if balance is None:
         st.error("User information not found.")
         return False
 
-    current_credit = user_info.get('credit', 0)
-    
-    if current_credit < amount:
+    if balance < amount:
         st.error("Insufficient credits.")
         return False
-    user_info['credit'] = current_credit - amount
-    user_database['credentials']['user_ids'][user_id] = user_info
-    save_yaml_to_github('user_database.yaml', user_database)
-    
+    entry = {"timestamp": datetime.datetime.now().isoformat(), "amount": -amount}
+    append_file(get_credit_ledger_path(user_id), json.dumps(entry) + "\n", "Deduct credit")
+
     return True
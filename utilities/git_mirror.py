@@ -0,0 +1,204 @@
+import os
+import time
+import atexit
+import threading
+import subprocess
+import contextlib
+
+# ===============================*** Git Working-Copy Mirror ***===============================
+
+class GitMirrorDivergedError(RuntimeError):
+    """Local commits conflict with the remote branch and cannot be pushed until someone merges them by hand."""
+
+
+class GitMirrorStorage:
+    """Local clone of the Data_Base repository: files are read from disk, committed locally and pushed in batches.
+
+    remote_url may be any git URL, including the path of a local bare repository.
+    """
+
+    def __init__(self, working_dir, remote_url, branch, push_interval=30, author_name="EduChange", author_email="educhange@localhost"):
+        self.working_dir = working_dir
+        self.remote_url = remote_url
+        self.branch = branch
+        self.push_interval = push_interval
+        self.author_name = author_name
+        self.author_email = author_email
+        # Every write happens inside transaction(), so outside of it the working tree is clean
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._cloned = False
+        self._push_thread = None
+        # Kept in .git so a restart still knows the mirror has diverged
+        self._divergence_path = os.path.join(working_dir, ".git", "educhange-diverged")
+
+    def _git(self, *args, check=True):
+        return subprocess.run(
+            ["git", "-C", self.working_dir, *args],
+            check=check, capture_output=True, text=True
+        )
+
+    def _ensure_clone(self):
+        # Cloned on first use, not at import, so a cold start makes no network calls
+        if self._cloned:
+            return
+        with self._lock:
+            if self._cloned:
+                return
+            if not os.path.isdir(os.path.join(self.working_dir, ".git")):
+                os.makedirs(os.path.dirname(os.path.abspath(self.working_dir)), exist_ok=True)
+                subprocess.run(["git", "clone", "--quiet", self.remote_url, self.working_dir], check=True, capture_output=True, text=True)
+                self._git("config", "user.name", self.author_name)
+                self._git("config", "user.email", self.author_email)
+                # An empty remote has no branch yet; start it locally
+                if self._git("rev-parse", "--verify", "--quiet", f"origin/{self.branch}", check=False).returncode == 0:
+                    self._git("checkout", "--quiet", "-B", self.branch, f"origin/{self.branch}")
+                else:
+                    self._git("checkout", "--quiet", "--orphan", self.branch)
+            # An existing clone keeps its unpushed commits from the previous run
+            self._cloned = True
+            divergence = self.divergence()
+            if divergence:
+                print(f"Git mirror has diverged, local commits are not being pushed: {divergence}")
+            self._start_push_thread()
+
+    def _full_path(self, path):
+        return os.path.join(self.working_dir, path)
+
+    @staticmethod
+    def _etag(stat):
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    @contextlib.contextmanager
+    def transaction(self, message=None):
+        """Stage the writes of one storage transaction and record them as a single local commit."""
+        self._ensure_clone()
+        with self._lock:
+            depth = getattr(self._local, "depth", 0)
+            self._local.depth = depth + 1
+            try:
+                yield
+            except BaseException:
+                if depth == 0:
+                    self._git("reset", "--quiet", "--hard", "HEAD", check=False)
+                    self._git("clean", "--quiet", "-fd", check=False)
+                raise
+            finally:
+                self._local.depth = depth
+            # Nested calls join the outermost transaction, which makes the one commit
+            if depth == 0 and self._git("diff", "--cached", "--quiet", check=False).returncode != 0:
+                self._git("commit", "--quiet", "-m", message or "Update data")
+
+    def read(self, path):
+        self._ensure_clone()
+        with self._lock:
+            try:
+                with open(self._full_path(path), encoding="utf-8") as f:
+                    return f.read()
+            except FileNotFoundError:
+                return None
+
+    def read_if_modified(self, path, etag=None):
+        self._ensure_clone()
+        with self._lock:
+            try:
+                stat = os.stat(self._full_path(path))
+            except FileNotFoundError:
+                return None, None
+            if self._etag(stat) == etag:
+                return None, etag
+            return self.read(path), self._etag(stat)
+
+    def exists(self, path):
+        self._ensure_clone()
+        return os.path.isfile(self._full_path(path))
+
+    def write(self, path, content, message=None):
+        with self.transaction(message):
+            full_path = self._full_path(path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, "w", encoding="utf-8") as f:
+                f.write(content)
+            self._git("add", "--", path)
+            return self._etag(os.stat(full_path))
+
+    def append(self, path, content, message=None):
+        with self.transaction(message):
+            full_path = self._full_path(path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, "a", encoding="utf-8") as f:
+                f.write(content)
+            self._git("add", "--", path)
+            return self._etag(os.stat(full_path))
+
+    def list(self, prefix):
+        self._ensure_clone()
+        with self._lock:
+            output = self._git("ls-files", "-z").stdout
+        return sorted(path for path in output.split("\0") if path and path.startswith(prefix))
+
+    def delete(self, path, message=None):
+        with self.transaction(message):
+            self._git("rm", "--quiet", "--ignore-unmatch", "--", path)
+
+    # ---------- Batched push ----------
+
+    def divergence(self):
+        """Return why local commits could not be rebased onto the remote, or None while pushes go through."""
+        try:
+            with open(self._divergence_path, encoding="utf-8") as f:
+                return f.read().strip() or "rebase conflict"
+        except FileNotFoundError:
+            return None
+
+    def _set_divergence(self, reason):
+        if reason is None:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._divergence_path)
+            return
+        with open(self._divergence_path, "w", encoding="utf-8") as f:
+            f.write(reason)
+
+    def push(self):
+        """Push local commits; if the remote moved, rebase onto it first.
+
+        Only the rebase holds the lock: fetching and pushing go over the network while transactions keep committing.
+        Raises GitMirrorDivergedError on every call until the conflicting commits are resolved.
+        """
+        self._ensure_clone()
+        self._git("fetch", "--quiet", "origin", check=False)
+        with self._lock:
+            if self._git("rev-parse", "--verify", "--quiet", f"origin/{self.branch}", check=False).returncode == 0:
+                rebase = self._git("rebase", "--quiet", f"origin/{self.branch}", check=False)
+                if rebase.returncode != 0:
+                    self._git("rebase", "--abort", check=False)
+                    conflict = "; ".join(line for line in rebase.stderr.splitlines() if line and not line.startswith("hint:"))
+                    reason = f"Could not rebase local commits onto origin/{self.branch}: {conflict}"
+                    self._set_divergence(reason)
+                    raise GitMirrorDivergedError(reason)
+                self._set_divergence(None)
+                ahead = self._git("rev-list", "--count", f"origin/{self.branch}..HEAD").stdout.strip()
+                if ahead == "0":
+                    return
+            head = self._git("rev-parse", "HEAD").stdout.strip()
+        # A commit made meanwhile goes out with the next push; a rejected push is rebased on the next one
+        self._git("push", "--quiet", "origin", f"{head}:refs/heads/{self.branch}")
+
+    def _run_push_loop(self):
+        while True:
+            time.sleep(self.push_interval)
+            self._push_and_report()
+
+    def _start_push_thread(self):
+        if self._push_thread is None:
+            self._push_thread = threading.Thread(target=self._run_push_loop, daemon=True)
+            self._push_thread.start()
+            atexit.register(self._push_and_report)
+
+    def _push_and_report(self):
+        try:
+            self.push()
+        except GitMirrorDivergedError as e:
+            print(f"Git mirror has diverged, local commits are not being pushed: {e}")
+        except Exception as e:
+            print(f"Error pushing git mirror: {e}")
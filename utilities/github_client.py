@@ -0,0 +1,176 @@
+import base64
+import asyncio
+import hashlib
+import httpx
+
+# ===============================*** Async GitHub Client ***===============================
+
+GITHUB_API_URL = "https://api.github.com"
+
+
+class GitHubAPIError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(f"GitHub API error {status_code}: {message}")
+        self.status_code = status_code
+
+
+class GitHubConflictError(GitHubAPIError):
+    """The file changed on GitHub since the version a write was based on."""
+
+    def __init__(self, path):
+        super().__init__(409, f"{path} changed on GitHub since it was read")
+        self.path = path
+
+
+def git_blob_sha(content):
+    """The sha GitHub gives a file with this content, computed without a request."""
+    data = content.encode("utf-8")
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+class AsyncGitHubClient:
+    """Contents and Git Data API calls over one pooled, keep-alive HTTP/2 connection."""
+
+    def __init__(self, token, owner, repo, branch, max_connections=10, timeout=30.0):
+        self.token = token
+        self.owner = owner
+        self.repo = repo
+        self.branch = branch
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._http = None
+
+    def _client(self):
+        # Created on first use so the pool belongs to the loop that runs the requests
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                base_url=f"{GITHUB_API_URL}/repos/{self.owner}/{self.repo}",
+                headers={
+                    "Authorization": f"Bearer {self.token}",
+                    "Accept": "application/vnd.github+json",
+                    "X-GitHub-Api-Version": "2022-11-28",
+                },
+                http2=True,
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                timeout=self.timeout,
+            )
+        return self._http
+
+    async def _request(self, method, url, expected=(200, 201), **kwargs):
+        response = await self._client().request(method, url, **kwargs)
+        if response.status_code not in expected:
+            raise GitHubAPIError(response.status_code, response.text)
+        return response
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    # ---------- Contents API ----------
+
+    async def get_file(self, path, etag=None):
+        """Return {"content", "sha", "etag"}, {"not_modified": True} on 304, or None when the file is missing."""
+        headers = {"If-None-Match": etag} if etag else {}
+        response = await self._request(
+            "GET", f"/contents/{path}", expected=(200, 304, 404),
+            params={"ref": self.branch}, headers=headers
+        )
+        if response.status_code == 304:
+            return {"not_modified": True, "etag": etag}
+        if response.status_code == 404:
+            return None
+        data = response.json()
+        if data.get("encoding") == "base64":
+            content = base64.b64decode(data["content"]).decode("utf-8")
+        else:
+            # Files over 1 MB come without inline content
+            raw = await self._request(
+                "GET", f"/contents/{path}", params={"ref": self.branch},
+                headers={"Accept": "application/vnd.github.raw"}
+            )
+            content = raw.text
+        return {"content": content, "sha": data["sha"], "etag": response.headers.get("ETag")}
+
+    async def get_file_sha(self, path, ref=None):
+        """Blob sha of the file at ref (the branch head by default), or None when it is missing."""
+        response = await self._request(
+            "GET", f"/contents/{path}", expected=(200, 404), params={"ref": ref or self.branch}
+        )
+        return response.json()["sha"] if response.status_code == 200 else None
+
+    async def put_file(self, path, content, message, sha=None):
+        """Create the file (sha None) or replace the version with that sha; anything else is a conflict."""
+        body = {
+            "message": message,
+            "content": base64.b64encode(content.encode("utf-8")).decode("ascii"),
+            "branch": self.branch,
+        }
+        if sha:
+            body["sha"] = sha
+        try:
+            response = await self._request("PUT", f"/contents/{path}", json=body)
+        except GitHubAPIError as e:
+            # 409: sha is not the current version; 422: the file exists but no sha was given
+            if e.status_code in (409, 422):
+                raise GitHubConflictError(path) from e
+            raise
+        return response.json()["content"]["sha"]
+
+    async def delete_file(self, path, message, sha):
+        try:
+            await self._request(
+                "DELETE", f"/contents/{path}", expected=(200, 404),
+                json={"message": message, "sha": sha, "branch": self.branch}
+            )
+        except GitHubAPIError as e:
+            if e.status_code == 409:
+                raise GitHubConflictError(path) from e
+            raise
+
+    async def list_directory(self, directory):
+        response = await self._request(
+            "GET", f"/contents/{directory}", expected=(200, 404), params={"ref": self.branch}
+        )
+        if response.status_code == 404:
+            return []
+        data = response.json()
+        if not isinstance(data, list):
+            data = [data]
+        return [item["path"] for item in data if item["type"] == "file"]
+
+    # ---------- Git Data API ----------
+
+    async def commit_changes(self, changes, message, base_shas=None):
+        """Write {path: content or None for deletion} as one commit: one tree, one commit, one ref update.
+
+        base_shas maps paths to the blob sha (None: missing) the change was based on; the commit is
+        refused with GitHubConflictError if any of them is no longer the version at the head.
+        """
+        ref = (await self._request("GET", f"/git/ref/heads/{self.branch}")).json()
+        head_sha = ref["object"]["sha"]
+        if base_shas:
+            current_shas = await asyncio.gather(*(self.get_file_sha(path, head_sha) for path in base_shas))
+            for (path, base_sha), current_sha in zip(base_shas.items(), current_shas):
+                if current_sha != base_sha:
+                    raise GitHubConflictError(path)
+        head_commit = (await self._request("GET", f"/git/commits/{head_sha}")).json()
+
+        tree_elements = []
+        for path, content in changes.items():
+            element = {"path": path, "mode": "100644", "type": "blob"}
+            if content is None:
+                element["sha"] = None
+            else:
+                element["content"] = content
+            tree_elements.append(element)
+
+        tree = (await self._request(
+            "POST", "/git/trees", json={"base_tree": head_commit["tree"]["sha"], "tree": tree_elements}
+        )).json()
+        commit = (await self._request(
+            "POST", "/git/commits", json={"message": message, "tree": tree["sha"], "parents": [head_sha]}
+        )).json()
+        # Not forced: if the head moved after the check above, this fails with 422 instead of overwriting
+        await self._request("PATCH", f"/git/refs/heads/{self.branch}", json={"sha": commit["sha"], "force": False})
+        return commit["sha"]
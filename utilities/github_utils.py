@@ -1,154 +1,177 @@
 import streamlit as st
 import yaml
-from github import Github
-import openai
-from io import BytesIO
 import json
+import copy
+import time
+import threading
+import contextlib
+from utilities.storage import read_file, read_file_if_modified, read_files_if_modified, write_file, storage_transaction, in_storage_transaction, storage_settings
 
 # ===============================*** Setup Configuration ***===============================
 
-# GitHub Access Token and Repository Details
-github_token = st.secrets["Github"]["github_token"]
-github_user = "Team-EduChange"
-github_repo = "Data_Base"
-github_branch = "main"
-
-# Initialize GitHub object
-g = Github(github_token)
-repo = g.get_repo(f"{github_user}/{github_repo}")
-
-# Set up OpenAI API
-openai.api_key = st.secrets["OpenAI"]["openai_api_key"]
-openai_client = openai.OpenAI(api_key=openai.api_key)
+# Process-wide cache of parsed YAML files: {file_path: {"data", "etag", "expires_at"}}
+yaml_cache_ttl = storage_settings.get("yaml_cache_ttl", 30)
+yaml_cache = {}
+yaml_cache_lock = threading.Lock()
 
 
 # ===============================*** GitHub File Management Functions ***===============================
 
 def load_yaml_from_github(file_path):
-    try:
-        content_file = repo.get_contents(file_path, ref=github_branch)
-        content = content_file.decoded_content.decode("utf-8")
-        return yaml.safe_load(content)
-    except Exception as e:
-        st.error(f"Error loading {file_path}: {str(e)}")
-        return None
+    return load_yamls_from_github(file_path)[0]
+
+def load_yamls_from_github(*file_paths):
+    """Load several YAML files at once; the ones that need a network round-trip are fetched concurrently."""
+    results = [None] * len(file_paths)
+    stale = []
+    with yaml_cache_lock:
+        entries = [yaml_cache.get(file_path) for file_path in file_paths]
+    for index, entry in enumerate(entries):
+        # Inside a transaction (read-modify-write) the entry is always revalidated
+        if entry and entry["expires_at"] > time.monotonic() and not in_storage_transaction():
+            results[index] = entry["data"]
+        else:
+            stale.append(index)
+
+    if stale:
+        try:
+            fetched = read_files_if_modified(
+                [(file_paths[index], entries[index]["etag"] if entries[index] else None) for index in stale]
+            )
+        except Exception as e:
+            st.error(f"Error loading {', '.join(file_paths[index] for index in stale)}: {str(e)}")
+            fetched = [(None, None)] * len(stale)
+
+        for index, (content, etag) in zip(stale, fetched):
+            file_path = file_paths[index]
+            entry = entries[index]
+            try:
+                if etag is None:
+                    raise FileNotFoundError(file_path)
+                if content is None:
+                    # Unchanged since the cached copy (304): extend its lifetime without parsing
+                    data = entry["data"]
+                else:
+                    data = yaml.safe_load(content)
+                with yaml_cache_lock:
+                    yaml_cache[file_path] = {"data": data, "etag": etag, "expires_at": time.monotonic() + yaml_cache_ttl}
+                results[index] = data
+            except Exception as e:
+                st.error(f"Error loading {file_path}: {str(e)}")
+
+    # Callers may mutate what they load, so never hand out the cached object
+    return [copy.deepcopy(data) for data in results]
 
 def save_student_text_data_to_github(data, filename):
     yaml_data = yaml.dump(data, allow_unicode=True, default_flow_style=False)
     file_path = f"submissions/{filename}.yaml"
-
-    try:
-        existing_file = repo.get_contents(file_path, ref=github_branch)
-        repo.update_file(
-            path=existing_file.path,
-            message="Update student submission data",
-            content=yaml_data,
-            sha=existing_file.sha,
-            branch=github_branch
-        )
-    except:
-        repo.create_file(
-            path=file_path,
-            message="Add new student submission data",
-            content=yaml_data,
-            branch=github_branch
-        )
+    write_file(file_path, yaml_data, "Update student submission data")
 
 
 def save_student_interview_data_to_github(data, filename):
     yaml_data = yaml.dump(data, allow_unicode=True, default_flow_style=False)
     yaml_file_path = f"submissions/{filename}.yaml"
-
-    try:
-        existing_file = repo.get_contents(yaml_file_path, ref=github_branch)
-        repo.update_file(
-            path=existing_file.path,
-            message="Update student submission data",
-            content=yaml_data,
-            sha=existing_file.sha,
-            branch=github_branch
-        )
-    except Exception:
-        repo.create_file(
-            path=yaml_file_path,
-            message="Add new student submission data",
-            content=yaml_data,
-            branch=github_branch
-        )
+    write_file(yaml_file_path, yaml_data, "Update student submission data")
 
 def save_yaml_to_github(file_path, data):
     yaml_data = yaml.dump(data, allow_unicode=True, default_flow_style=False)
+    etag = write_file(file_path, yaml_data, "Update user database")
+    with yaml_cache_lock:
+        if etag:
+            yaml_cache[file_path] = {"data": copy.deepcopy(data), "etag": etag, "expires_at": time.monotonic() + yaml_cache_ttl}
+        else:
+            yaml_cache.pop(file_path, None)
+
+# Serialises read-modify-write of shared files (credits, counters) between sessions of this process
+submission_lock = threading.RLock()
+
+@contextlib.contextmanager
+def submission_transaction(message):
+    """Persist every file change of one submission as a single commit."""
     try:
-        existing_file = repo.get_contents(file_path, ref=github_branch)
-        repo.update_file(
-            path=existing_file.path,
-            message="Update user database",
-            content=yaml_data,
-            sha=existing_file.sha,
-            branch=github_branch
-        )
-    except Exception:
-        repo.create_file(
-            path=file_path,
-            message="Create user database",
-            content=yaml_data,
-            branch=github_branch
-        )
+        with submission_lock, storage_transaction(message):
+            yield
+    except BaseException:
+        # Rolled-back writes may already have refreshed the in-memory caches
+        with yaml_cache_lock:
+            yaml_cache.clear()
+        with submission_count_lock:
+            submission_count_index.clear()
+        raise
 
 # ===============================*** Student Submission Tracking Functions ***===============================
 
+# Counters are sharded per teacher and project; the index keeps loaded shards: {shard_path: {"counts", "etag"}}
+SUBMISSION_COUNT_DIR = "submission_counts"
+LEGACY_SUBMISSION_FILE = "submission_data.json"
+submission_count_index = {}
+submission_count_lock = threading.Lock()
+legacy_submission_data = None
+
 def load_data_from_github():
-    try:
-        file_path = "submission_data.json"  
-        file_content = repo.get_contents(file_path, ref=github_branch)
-        data = json.loads(file_content.decoded_content.decode("utf-8"))
-        return data
-    except Exception as e:
-        st.error(f"제출 기록을 불러오는 중 오류 발생: {str(e)}")
+    # Read errors propagate: an empty result would seed shards with zero counts and be cached for good
+    content = read_file(LEGACY_SUBMISSION_FILE)
+    if content is None:
         return {}
-
-def save_data_to_github(data):
-    try:
-        file_path = "submission_data.json"
-        json_data = json.dumps(data, indent=4, ensure_ascii=False)  
-        try:
-            file_content = repo.get_contents(file_path, ref=github_branch)
-            repo.update_file(
-                file_path,
-                "Update submission data",
-                json_data,  
-                file_content.sha,
-                branch=github_branch
-            )
-        except Exception:
-            repo.create_file(
-                file_path,
-                "Create submission data",
-                json_data, 
-                branch=github_branch
-            )
-    except Exception as e:
-        st.error(f"제출 기록을 저장하는 중 오류 발생: {str(e)}")
+    return json.loads(content)
+
+def get_submission_shard_path(user_id, service_name, project_name):
+    return f"{SUBMISSION_COUNT_DIR}/{user_id}/{service_name}_{project_name}.json"
+
+def get_student_key(grade, class_num, number, name):
+    return f"{grade}_{class_num}_{number}_{name}"
+
+def load_legacy_submission_shard(user_id, service_name, project_name):
+    # Seed a new shard from the old monolithic file, which is read at most once per process
+    global legacy_submission_data
+    if legacy_submission_data is None:
+        legacy_submission_data = load_data_from_github()
+    prefix = f"{user_id}_"
+    suffix = f"_{service_name}_{project_name}"
+    return {
+        key[len(prefix):-len(suffix)]: count
+        for key, count in legacy_submission_data.items()
+        if key.startswith(prefix) and key.endswith(suffix) and len(key) > len(prefix) + len(suffix)
+    }
+
+def load_submission_shard(shard_path, user_id, service_name, project_name):
+    entry = submission_count_index.get(shard_path)
+    content, etag = read_file_if_modified(shard_path, entry["etag"] if entry else None)
+    if etag is None:
+        counts = load_legacy_submission_shard(user_id, service_name, project_name)
+    elif content is None:
+        counts = entry["counts"]
+    else:
+        counts = json.loads(content)
+    submission_count_index[shard_path] = {"counts": counts, "etag": etag}
+    return counts
 
 def get_submission_count(user_id, grade, class_num, number, name, service_name, project_name):
     try:
-        data = load_data_from_github()
-        student_key = f"{user_id}_{grade}_{class_num}_{number}_{name}_{service_name}_{project_name}"
-        return data.get(student_key, 0)
+        shard_path = get_submission_shard_path(user_id, service_name, project_name)
+        with submission_count_lock:
+            counts = load_submission_shard(shard_path, user_id, service_name, project_name)
+        return counts.get(get_student_key(grade, class_num, number, name), 0)
     except Exception as e:
         st.error(f"제출 기록을 불러오는 중 오류 발생: {str(e)}")
         return 0
 
 def update_submission_count(user_id, grade, class_num, number, name, service_name, project_name):
     try:
-        data = load_data_from_github()
-        student_key = f"{user_id}_{grade}_{class_num}_{number}_{name}_{service_name}_{project_name}"
-        if student_key in data:
-            data[student_key] += 1
-        else:
-            data[student_key] = 1
-        save_data_to_github(data)
+        shard_path = get_submission_shard_path(user_id, service_name, project_name)
+        student_key = get_student_key(grade, class_num, number, name)
+        with submission_count_lock:
+            counts = dict(load_submission_shard(shard_path, user_id, service_name, project_name))
+            counts[student_key] = counts.get(student_key, 0) + 1
+            etag = write_file(shard_path, json.dumps(counts, indent=4, ensure_ascii=False), "Update submission data")
+            if etag:
+                submission_count_index[shard_path] = {"counts": counts, "etag": etag}
+            else:
+                submission_count_index.pop(shard_path, None)
     except Exception as e:
+        # Inside a submission transaction the whole submission must roll back, credit and record included
+        if in_storage_transaction():
+            raise
         st.error(f"제출 기록을 업데이트하는 중 오류 발생: {str(e)}")
 
 
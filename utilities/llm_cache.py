@@ -0,0 +1,49 @@
+import json
+import hashlib
+import streamlit as st
+from utilities.sqlite_cache import SQLiteLRUCache
+
+# ===============================*** Setup Configuration ***===============================
+
+# Response cache settings (optional [LLMCache] section in secrets.toml)
+llm_cache_settings = st.secrets.get("LLMCache", {})
+llm_cache_enabled = llm_cache_settings.get("enabled", True)
+llm_cache_path = llm_cache_settings.get("path", "local_data/llm_cache.db")
+llm_cache_max_bytes = llm_cache_settings.get("max_bytes", 200 * 1024 * 1024)
+
+response_cache = SQLiteLRUCache(
+    llm_cache_path, "responses", "response", llm_cache_max_bytes, namespaced=True,
+    setup_statements=(
+        "CREATE TABLE IF NOT EXISTS namespace_templates ("
+        " namespace TEXT PRIMARY KEY,"
+        " template_hash TEXT NOT NULL)",
+    )
+)
+
+# ===============================*** Response Cache ***===============================
+
+def make_cache_key(model, messages, params):
+    """Content address of a request: hash of model, final messages and generation parameters."""
+    payload = json.dumps({"model": model, "messages": messages, "params": params}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def sync_namespace_template(namespace, prompt_template):
+    # A project whose prompt_template changed loses every response cached under the old one
+    template_hash = hashlib.sha256((prompt_template or "").encode("utf-8")).hexdigest()
+    conn = response_cache.connection()
+    row = conn.execute("SELECT template_hash FROM namespace_templates WHERE namespace = ?", (namespace,)).fetchone()
+    if row and row[0] == template_hash:
+        return
+    with conn:
+        response_cache.delete_namespace(namespace, conn)
+        conn.execute(
+            "INSERT INTO namespace_templates (namespace, template_hash) VALUES (?, ?) "
+            "ON CONFLICT(namespace) DO UPDATE SET template_hash = excluded.template_hash",
+            (namespace, template_hash)
+        )
+
+def get_cached_response(key):
+    return response_cache.get(key)
+
+def store_response(key, namespace, response):
+    response_cache.put(key, response, namespace)
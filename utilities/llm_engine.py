@@ -0,0 +1,324 @@
+import time
+import queue
+import random
+import asyncio
+import threading
+import concurrent.futures
+import openai
+import streamlit as st
+from utilities.async_runtime import submit_async, gather_async
+from utilities.clients import get_async_openai_client
+from utilities.token_budget import count_message_tokens
+
+# ===============================*** Setup Configuration ***===============================
+
+# Account limits shared by every session of this process (optional [LLM] section in secrets.toml)
+llm_settings = st.secrets.get("LLM", {})
+requests_per_minute = llm_settings.get("requests_per_minute", 500)
+tokens_per_minute = llm_settings.get("tokens_per_minute", 30000)
+# Only reserves rate-limit tokens for requests without max_tokens; output is capped only where a project sets max_tokens
+default_output_tokens = llm_settings.get("default_output_tokens", 1000)
+default_timeout_seconds = llm_settings.get("default_timeout_seconds", 90)
+# How often a waiting consumer checks whether its caller is still there
+cancel_poll_seconds = llm_settings.get("cancel_poll_seconds", 0.5)
+
+# Transient errors (429, 5xx, connection) are retried with jittered exponential backoff
+max_retries = llm_settings.get("max_retries", 4)
+retry_base_seconds = llm_settings.get("retry_base_seconds", 1)
+retry_max_seconds = llm_settings.get("retry_max_seconds", 20)
+
+# A model that keeps failing is skipped for breaker_cooldown_seconds
+breaker_failure_threshold = llm_settings.get("breaker_failure_threshold", 5)
+breaker_cooldown_seconds = llm_settings.get("breaker_cooldown_seconds", 30)
+
+# Keyed by service kind, e.g. {"수행평가 채점" = "gpt-4o-mini"}; a project's fallback_model field takes precedence
+fallback_models = llm_settings.get("fallback_models", {})
+
+# ===============================*** Token Bucket Rate Limiter ***===============================
+
+class TokenBucket:
+    """Refills continuously at capacity per minute; callers wait until enough tokens are available."""
+
+    def __init__(self, capacity_per_minute):
+        self.capacity = capacity_per_minute
+        self.refill_per_second = capacity_per_minute / 60.0
+        self.tokens = capacity_per_minute
+        self.updated_at = time.monotonic()
+        # Guarded by a thread lock, not an asyncio one, so the bucket works from any loop
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    def try_acquire(self, amount):
+        """Take amount tokens and return 0, or return the seconds to wait before trying again."""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0
+            return (amount - self.tokens) / self.refill_per_second
+
+    async def acquire(self, amount):
+        while True:
+            wait_seconds = self.try_acquire(amount)
+            if wait_seconds == 0:
+                return
+            await asyncio.sleep(wait_seconds)
+
+    def refund(self, amount):
+        # Negative amounts charge for usage beyond the estimate
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+request_bucket = TokenBucket(requests_per_minute)
+token_bucket = TokenBucket(tokens_per_minute)
+
+# ===============================*** Circuit Breaker ***===============================
+
+class GenerationTimeoutError(TimeoutError):
+    """A generation overran its latency SLO and was cancelled."""
+
+
+class GenerationCancelledError(RuntimeError):
+    """The caller went away (page closed or navigated) and the generation was cancelled."""
+
+
+class CircuitOpenError(RuntimeError):
+    """The model's circuit is open: recent requests kept failing, so new ones fail fast."""
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures; after cooldown_seconds one trial request may pass."""
+
+    def __init__(self, failure_threshold, cooldown_seconds):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.trial_in_flight or time.monotonic() - self.opened_at < self.cooldown_seconds:
+                return False
+            # Half-open: let a single request find out whether the provider recovered
+            self.trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def release_trial(self):
+        # A cancelled trial proves nothing either way; the next request may try again
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+
+breakers = {}
+breakers_lock = threading.Lock()
+
+def get_breaker(model):
+    with breakers_lock:
+        if model not in breakers:
+            breakers[model] = CircuitBreaker(breaker_failure_threshold, breaker_cooldown_seconds)
+        return breakers[model]
+
+def get_generation_settings(selected_project):
+    """Per-project generation limits from project_database.yaml, falling back to the [LLM] defaults."""
+    project = selected_project or {}
+    return {
+        "max_tokens": project.get('max_tokens'),
+        "temperature": project.get('temperature', 0.0),
+        "timeout": project.get('timeout_seconds', default_timeout_seconds),
+    }
+
+def get_fallback_model(selected_project, service_name):
+    if selected_project and selected_project.get('fallback_model'):
+        return selected_project['fallback_model']
+    for service_kind, model in fallback_models.items():
+        if service_kind in (service_name or ""):
+            return model
+    return None
+
+# ===============================*** Async Request Engine ***===============================
+
+def is_retryable(error):
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+def get_retry_delay(error, attempt):
+    # Full jitter spreads out the retries of every session that hit the same error storm
+    delay = random.uniform(0, min(retry_max_seconds, retry_base_seconds * 2 ** attempt))
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return max(delay, min(float(retry_after), retry_max_seconds)) if retry_after else delay
+    except ValueError:
+        return delay
+
+async def stream_attempt(output, model, messages, params, progress):
+    # Reconciled with the real usage once the response reports it
+    estimated_tokens = count_message_tokens(messages, model) + params.get("max_tokens", default_output_tokens)
+    await request_bucket.acquire(1)
+    await token_bucket.acquire(estimated_tokens)
+
+    used_tokens = None
+    try:
+        stream = await get_async_openai_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            **params
+        )
+        try:
+            async for chunk in stream:
+                if chunk.usage:
+                    used_tokens = chunk.usage.total_tokens
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.delta.content or choice.finish_reason:
+                    output.put(("chunk", (choice.delta.content or "", choice.finish_reason, model)))
+                    progress["started"] = True
+        finally:
+            await stream.close()
+    finally:
+        if used_tokens is not None:
+            token_bucket.refund(estimated_tokens - used_tokens)
+        elif not progress["started"]:
+            # Rejected before generating anything, so nothing was consumed
+            token_bucket.refund(estimated_tokens)
+
+async def run_completion(output, model, messages, params, fallback_model=None):
+    progress = {"started": False}
+    try:
+        last_error = None
+        for candidate in [model] + ([fallback_model] if fallback_model and fallback_model != model else []):
+            breaker = get_breaker(candidate)
+            for attempt in range(max_retries + 1):
+                if not breaker.allow():
+                    last_error = CircuitOpenError(f"Circuit open for {candidate}")
+                    break
+                try:
+                    await stream_attempt(output, candidate, messages, params, progress)
+                except asyncio.CancelledError:
+                    breaker.release_trial()
+                    raise
+                except Exception as e:
+                    if not is_retryable(e):
+                        breaker.record_success()
+                        raise
+                    breaker.record_failure()
+                    last_error = e
+                    # Text already shown on the page cannot be taken back, so a broken stream is not retried
+                    if progress["started"]:
+                        raise
+                    if attempt < max_retries:
+                        await asyncio.sleep(get_retry_delay(e, attempt))
+                    continue
+                breaker.record_success()
+                output.put(("end", None))
+                return
+        raise last_error
+    except BaseException as e:
+        output.put(("error", e))
+        raise
+
+def stream_completion(model, messages, fallback_model=None, timeout=None, should_cancel=None, on_submit=None, deadline=None, **params):
+    """Yield (content, finish_reason, model) triples of a streamed completion run on the shared async engine.
+
+    Transient errors are retried; when model is failing or its circuit is open, fallback_model answers instead.
+    The whole generation, retries included, must finish within timeout seconds or GenerationTimeoutError is raised;
+    deadline (a time.monotonic() value) sets the same limit for steps that share one time budget; the earlier of the two wins.
+    While waiting for output, should_cancel() is polled; when it returns True the request is cancelled.
+    on_submit(future) receives the running request, so its owner can cancel it from elsewhere.
+    """
+    output = queue.Queue()
+    future = submit_async(run_completion(output, model, messages, params, fallback_model))
+    if on_submit:
+        on_submit(future)
+    if timeout:
+        timeout_deadline = time.monotonic() + timeout
+        deadline = timeout_deadline if deadline is None else min(deadline, timeout_deadline)
+    try:
+        while True:
+            wait_seconds = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if should_cancel:
+                wait_seconds = cancel_poll_seconds if wait_seconds is None else min(wait_seconds, cancel_poll_seconds)
+            try:
+                kind, value = output.get(timeout=wait_seconds)
+            except queue.Empty:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise GenerationTimeoutError(f"{model} did not finish before its deadline")
+                if should_cancel and should_cancel():
+                    raise GenerationCancelledError(f"{model} generation abandoned by its caller")
+                continue
+            if kind == "chunk":
+                yield value
+            elif kind == "error":
+                raise value
+            else:
+                return
+    finally:
+        # A consumer that stops early (closed generator, error) must not leave the request running
+        future.cancel()
+
+async def collect_completion(model, messages, params, fallback_model=None):
+    output = queue.Queue()
+    await run_completion(output, model, messages, params, fallback_model)
+    pieces = []
+    while not output.empty():
+        kind, value = output.get_nowait()
+        if kind == "chunk":
+            pieces.append(value[0])
+    return "".join(pieces)
+
+def complete_parallel(model, message_lists, fallback_model=None, timeout=None, should_cancel=None, on_submit=None, deadline=None, **params):
+    """Run several completions concurrently on the shared engine and return their texts in order.
+
+    timeout, deadline, should_cancel and on_submit behave as in stream_completion and apply to the whole group;
+    the first failure cancels the completions still running.
+    """
+    future = submit_async(gather_async(*[
+        collect_completion(model, messages, params, fallback_model) for messages in message_lists
+    ]))
+    if on_submit:
+        on_submit(future)
+    if timeout:
+        timeout_deadline = time.monotonic() + timeout
+        deadline = timeout_deadline if deadline is None else min(deadline, timeout_deadline)
+    try:
+        while True:
+            wait_seconds = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if should_cancel:
+                wait_seconds = cancel_poll_seconds if wait_seconds is None else min(wait_seconds, cancel_poll_seconds)
+            try:
+                return future.result(timeout=wait_seconds)
+            except concurrent.futures.TimeoutError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise GenerationTimeoutError(f"{model} did not finish before its deadline")
+                if should_cancel and should_cancel():
+                    raise GenerationCancelledError(f"{model} generation abandoned by its caller")
+    finally:
+        future.cancel()
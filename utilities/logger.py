@@ -1,17 +1,34 @@
 import streamlit as st
 import datetime
 import json
-from github import Github
+import time
+import queue
+import atexit
+import threading
+from utilities.storage import read_file, append_file, list_files, delete_file, storage_transaction
 
-# GitHub Repository Info
-github_token = st.secrets["Github"]["github_token"]
-github_user = "Team-EduChange"
-github_repo = "Data_Base"
-github_branch = "main"
+# Log partitioning (optional [Logging] section in secrets.toml)
+logging_settings = st.secrets.get("Logging", {})
+log_partition = logging_settings.get("partition", "day")  # "day" or "hour"
+log_archive_after_days = logging_settings.get("archive_after_days", 7)
+log_compaction_interval = logging_settings.get("compaction_interval_seconds", 6 * 60 * 60)
 
-# Initialize GitHub object
-g = Github(github_token)
-repo = g.get_repo(f"{github_user}/{github_repo}")
+# Write-behind buffer: flush after log_batch_size events or log_flush_interval seconds
+log_batch_size = logging_settings.get("batch_size", 50)
+log_flush_interval = logging_settings.get("flush_interval_seconds", 5)
+log_buffer_size = logging_settings.get("buffer_size", 1000)
+log_enqueue_timeout = logging_settings.get("enqueue_timeout_seconds", 2)
+log_shutdown_timeout = logging_settings.get("shutdown_timeout_seconds", 10)
+
+LOG_PARTITION_DIR = "logs/events/"
+LOG_ARCHIVE_DIR = "logs/archive/"
+
+compaction_thread = None
+compaction_thread_lock = threading.Lock()
+
+log_queue = queue.Queue(maxsize=log_buffer_size)
+log_writer_thread = None
+log_writer_lock = threading.Lock()
 
 def log_event(event_type, details):
     timestamp = datetime.datetime.now().isoformat()
@@ -26,40 +43,119 @@ def log_event(event_type, details):
     
     st.session_state['logs'].append(log_entry)
     
-    save_log_to_github(log_entry)
+    enqueue_log_entry(log_entry)
 
 
-def save_log_to_github(log_entry):
-    file_path = "logs/log_data.json" 
-    
+def get_log_partition_path(timestamp):
+    if log_partition == "hour":
+        return f"{LOG_PARTITION_DIR}{timestamp.strftime('%Y-%m-%d-%H')}.jsonl"
+    return f"{LOG_PARTITION_DIR}{timestamp.strftime('%Y-%m-%d')}.jsonl"
+
+def save_log_to_github(log_entries):
+    # Append-only: each batch costs one append per partition, regardless of log history
+    partitions = {}
+    for log_entry in log_entries:
+        file_path = get_log_partition_path(datetime.datetime.fromisoformat(log_entry["timestamp"]))
+        partitions.setdefault(file_path, []).append(json.dumps(log_entry, ensure_ascii=False))
+
+    for file_path, lines in partitions.items():
+        try:
+            append_file(file_path, "\n".join(lines) + "\n", f"Appending {len(lines)} log entries")
+        except Exception as e:
+            print(f"Error saving log to GitHub: {e}")
+    start_log_compaction()
+
+# ===============================*** Write-behind Buffer ***===============================
+
+def enqueue_log_entry(log_entry):
+    start_log_writer()
     try:
+        log_queue.put(log_entry, timeout=log_enqueue_timeout)
+    except queue.Full:
+        # Backpressure: the buffer is full, so the caller pays for the write itself
+        save_log_to_github([log_entry])
+
+def run_log_writer():
+    stopping = False
+    while not stopping:
+        log_entry = log_queue.get()
+        if log_entry is None:
+            break
+        batch = [log_entry]
+        deadline = time.monotonic() + log_flush_interval
+        while len(batch) < log_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                log_entry = log_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if log_entry is None:
+                stopping = True
+                break
+            batch.append(log_entry)
+        save_log_to_github(batch)
+
+def start_log_writer():
+    global log_writer_thread
+    with log_writer_lock:
+        if log_writer_thread is None:
+            log_writer_thread = threading.Thread(target=run_log_writer, daemon=True)
+            log_writer_thread.start()
+            atexit.register(flush_log_queue)
+
+def flush_log_queue():
+    # Drain buffered events on process shutdown
+    if log_writer_thread is not None and log_writer_thread.is_alive():
+        try:
+            log_queue.put(None, timeout=log_shutdown_timeout)
+        except queue.Full:
+            pass
+        log_writer_thread.join(timeout=log_shutdown_timeout)
+
+    remaining = []
+    while True:
+        try:
+            log_entry = log_queue.get_nowait()
+        except queue.Empty:
+            break
+        if log_entry is not None:
+            remaining.append(log_entry)
+    if remaining:
+        save_log_to_github(remaining)
+
+# ===============================*** Log Compaction ***===============================
+
+def compact_log_partitions():
+    # Partitions older than log_archive_after_days are folded into one archive file per month
+    cutoff = (datetime.date.today() - datetime.timedelta(days=log_archive_after_days)).isoformat()
+    for file_path in list_files(LOG_PARTITION_DIR):
+        partition_date = file_path[len(LOG_PARTITION_DIR):][:10]
+        if partition_date >= cutoff:
+            continue
+        # Archived and removed together: a failure in between must neither lose nor duplicate the partition
+        with storage_transaction(f"Archive log partition {partition_date}"):
+            content = read_file(file_path)
+            if content:
+                archive_path = f"{LOG_ARCHIVE_DIR}{partition_date[:7]}.jsonl"
+                append_file(archive_path, content, f"Archive log partition {partition_date}")
+            delete_file(file_path, f"Remove archived log partition {partition_date}")
+
+def run_log_compaction():
+    while True:
         try:
-            file_content = repo.get_contents(file_path, ref=github_branch)
-            existing_logs = json.loads(file_content.decoded_content.decode('utf-8'))
-            sha = file_content.sha 
-        except Exception:
-            existing_logs = []
-            sha = None
-
-        existing_logs.append(log_entry)
-
-        if sha:
-            repo.update_file(
-                path=file_path,
-                message="Appending new log entry",
-                content=json.dumps(existing_logs, ensure_ascii=False, indent=4),
-                sha=sha,  
-                branch=github_branch
-            )
-        else:
-            repo.create_file(
-                path=file_path,
-                message="Creating log file with the first log entry",
-                content=json.dumps(existing_logs, ensure_ascii=False, indent=4),
-                branch=github_branch
-            )
-    except Exception as e:
-        st.error(f"Error saving log to GitHub: {e}")
+            compact_log_partitions()
+        except Exception as e:
+            print(f"Error compacting log partitions: {e}")
+        time.sleep(log_compaction_interval)
+
+def start_log_compaction():
+    global compaction_thread
+    with compaction_thread_lock:
+        if compaction_thread is None:
+            compaction_thread = threading.Thread(target=run_log_compaction, daemon=True)
+            compaction_thread.start()
 
 # Function to log login with timestamp
 def log_login(user_id):
@@ -89,3 +185,53 @@ def log_credit_transaction(user_id, transaction_type, amount, user_credits_after
         "service_usage_count": st.session_state['service_usage_count'][service_id] 
     }
     log_event("credit_transaction", details)
+
+# Function to log the prompt size of each LLM request against its budget
+def log_token_usage(user_id, service_name, project_name, model, token_usage):
+    details = {
+        "user_id": user_id,
+        "service_name": service_name,
+        "project_name": project_name,
+        "model": model,
+        "budget": token_usage["budget"],
+        "original_prompt_tokens": token_usage["original_prompt_tokens"],
+        "prompt_tokens": token_usage["prompt_tokens"],
+        "truncated_sections": token_usage["truncated_sections"]
+    }
+    log_event("token_usage", details)
+
+# Function to log generations cancelled for overrunning their latency SLO
+def log_generation_timeout(user_id, service_name, project_name, model, timeout_seconds):
+    details = {
+        "user_id": user_id,
+        "service_name": service_name,
+        "project_name": project_name,
+        "model": model,
+        "timeout_seconds": timeout_seconds,
+        "cancelled_at": datetime.datetime.now().isoformat()
+    }
+    log_event("generation_timeout", details)
+
+# Function to log generations that failed or were abandoned before a response was saved
+def log_generation_failure(user_id, service_name, project_name, model, error):
+    details = {
+        "user_id": user_id,
+        "service_name": service_name,
+        "project_name": project_name,
+        "model": model,
+        "error_type": type(error).__name__,
+        "error": str(error),
+        "failed_at": datetime.datetime.now().isoformat()
+    }
+    log_event("generation_failure", details)
+
+# Function to log responses cut off at max_tokens
+def log_generation_truncated(user_id, model, max_tokens, cache_namespace):
+    details = {
+        "user_id": user_id,
+        "model": model,
+        "max_tokens": max_tokens,
+        "cache_namespace": cache_namespace,
+        "truncated_at": datetime.datetime.now().isoformat()
+    }
+    log_event("generation_truncated", details)
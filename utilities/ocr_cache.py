@@ -0,0 +1,27 @@
+import hashlib
+import streamlit as st
+from utilities.sqlite_cache import SQLiteLRUCache
+
+# ===============================*** Setup Configuration ***===============================
+
+# OCR cache settings (optional [OCRCache] section in secrets.toml)
+ocr_cache_settings = st.secrets.get("OCRCache", {})
+ocr_cache_enabled = ocr_cache_settings.get("enabled", True)
+ocr_cache_path = ocr_cache_settings.get("path", "local_data/ocr_cache.db")
+ocr_cache_max_bytes = ocr_cache_settings.get("max_bytes", 50 * 1024 * 1024)
+
+ocr_result_cache = SQLiteLRUCache(ocr_cache_path, "ocr_results", "text", ocr_cache_max_bytes)
+
+# ===============================*** OCR Result Cache ***===============================
+
+def make_image_key(image_bytes):
+    """Content address of a page image, taken after preprocessing so the same page always hashes the same."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+def get_cached_texts(keys):
+    """Return {key: text} for the keys that are cached, marking them as recently used."""
+    return ocr_result_cache.get_many(keys)
+
+def store_texts(texts):
+    """Cache {key: text} and evict the least recently used results beyond the size cap."""
+    ocr_result_cache.put_many(texts)
@@ -1,15 +1,44 @@
 import re
 import io
+import threading
+import concurrent.futures
 import streamlit as st
 import fitz  # For handling PDFs
+from PIL import Image, ImageOps
 from google.cloud import vision
-from google.oauth2 import service_account
+from utilities.clients import get_vision_client
+from utilities.ocr_cache import ocr_cache_enabled, make_image_key, get_cached_texts, store_texts
 
 # ===============================*** Setup Configuration ***===============================
 
-# Set up Google Cloud Vision API
-credentials = service_account.Credentials.from_service_account_info(st.secrets["Google"])
-vision_client = vision.ImageAnnotatorClient(credentials=credentials)
+# OCR settings (optional [OCR] section in secrets.toml)
+ocr_settings = st.secrets.get("OCR", {})
+ocr_max_workers = ocr_settings.get("max_workers", 8)
+# Images per batch_annotate_images request; the Vision API accepts at most 16
+ocr_batch_size = min(ocr_settings.get("batch_size", 16), 16)
+# Bytes per request; a batch is closed early rather than approach Vision's 10 MB request limit
+ocr_max_request_bytes = ocr_settings.get("max_request_bytes", 8 * 1024 * 1024)
+
+# Image preprocessing before upload (see benchmarks/ocr_preprocessing_benchmark.py)
+ocr_render_dpi = ocr_settings.get("render_dpi", 200)
+ocr_grayscale = ocr_settings.get("grayscale", True)
+ocr_binarize = ocr_settings.get("binarize", False)
+ocr_binarize_threshold = ocr_settings.get("binarize_threshold", 160)
+ocr_image_format = ocr_settings.get("image_format", "JPEG")  # "JPEG", "WEBP" or "PNG"
+ocr_image_quality = ocr_settings.get("image_quality", 85)
+# Per image; how many fit in one request is bounded by ocr_max_request_bytes
+ocr_max_image_bytes = ocr_settings.get("max_image_bytes", 600 * 1024)
+
+# Vision calls are network-bound, so one thread pool is shared by every session of the process
+ocr_executor = None
+ocr_executor_lock = threading.Lock()
+
+def get_ocr_executor():
+    global ocr_executor
+    with ocr_executor_lock:
+        if ocr_executor is None:
+            ocr_executor = concurrent.futures.ThreadPoolExecutor(max_workers=ocr_max_workers, thread_name_prefix="ocr")
+    return ocr_executor
 
 # ===============================*** Document Processing Functions ***===============================
 
@@ -61,26 +90,137 @@ def process_detailed_skills(detailed_skills):
 
     return detailed_skills
 
-def extract_text_from_pdf(file):
-    pdf_document = fitz.open(stream=file.read(), filetype="pdf")
-    extracted_text = ""
-    for page_num in range(len(pdf_document)):
-        page = pdf_document.load_page(page_num)
-        text = page.get_text()
-        extracted_text += text
-        if not text.strip():
-            image = page.get_pixmap()
-            image_bytes = image.tobytes("png")
-            image = vision.Image(content=image_bytes)
-            response = vision_client.text_detection(image=image)
-
-            if response.text_annotations:
-                extracted_text += response.text_annotations[0].description
-    return extracted_text
-
-
-def convert_image_to_pdf_bytes(image):
-    pdf_buffer = io.BytesIO()
-    image.convert('RGB').save(pdf_buffer, format="PDF")
-    pdf_buffer.seek(0) 
-    return pdf_buffer.getvalue()
+def annotate_image_batch(images_bytes):
+    requests = [
+        vision.AnnotateImageRequest(
+            image=vision.Image(content=image_bytes),
+            features=[vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)]
+        )
+        for image_bytes in images_bytes
+    ]
+    response = get_vision_client().batch_annotate_images(requests=requests)
+    # Responses come back in request order; a failed image is None so it is not cached
+    return [
+        None if image_response.error.message
+        else image_response.text_annotations[0].description if image_response.text_annotations
+        else ""
+        for image_response in response.responses
+    ]
+
+def batch_images(images_bytes):
+    """Split images, in order, into Vision requests of at most ocr_batch_size images and ocr_max_request_bytes."""
+    batches = []
+    batch_bytes = 0
+    for image_bytes in images_bytes:
+        if not batches or len(batches[-1]) == ocr_batch_size or batch_bytes + len(image_bytes) > ocr_max_request_bytes:
+            batches.append([])
+            batch_bytes = 0
+        batches[-1].append(image_bytes)
+        batch_bytes += len(image_bytes)
+    return batches
+
+def ocr_images(images_bytes):
+    """OCR every image, batched by batch_images into Vision requests with the batches run in parallel; returns texts in order.
+
+    Images OCR'd before (resubmitted photos and pages) are answered from the OCR cache without a Vision call.
+    """
+    keys = [make_image_key(image_bytes) for image_bytes in images_bytes]
+    texts = get_cached_texts(keys) if ocr_cache_enabled else {}
+
+    pending = {}
+    for key, image_bytes in zip(keys, images_bytes):
+        if key not in texts:
+            pending.setdefault(key, image_bytes)
+    pending_keys = list(pending)
+    futures = [
+        get_ocr_executor().submit(annotate_image_batch, batch)
+        for batch in batch_images([pending[key] for key in pending_keys])
+    ]
+    try:
+        results = dict(zip(pending_keys, (text for future in futures for text in future.result())))
+    finally:
+        for future in futures:
+            future.cancel()
+
+    if ocr_cache_enabled:
+        store_texts({key: text for key, text in results.items() if text is not None})
+    texts.update(results)
+    return [texts[key] or "" for key in keys]
+
+# ===============================*** OCR Image Preprocessing ***===============================
+
+def render_page_for_ocr(page, dpi=None, grayscale=None):
+    """Rasterise a fitz page straight into a PIL image at the OCR resolution."""
+    dpi = ocr_render_dpi if dpi is None else dpi
+    grayscale = ocr_grayscale if grayscale is None else grayscale
+    pixmap = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY if grayscale else fitz.csRGB, alpha=False)
+    return Image.frombytes("L" if grayscale else "RGB", (pixmap.width, pixmap.height), pixmap.samples)
+
+def encode_image(image, image_format, quality):
+    image_buffer = io.BytesIO()
+    if image_format == "PNG":
+        image.save(image_buffer, format="PNG", optimize=True)
+    else:
+        image.save(image_buffer, format=image_format, quality=quality)
+    return image_buffer.getvalue()
+
+def preprocess_image_for_ocr(image, grayscale=None, binarize=None, image_format=None, max_bytes=None):
+    """Grayscale, optionally binarise, and encode an image within max_bytes: lower quality first, then downscale."""
+    grayscale = ocr_grayscale if grayscale is None else grayscale
+    binarize = ocr_binarize if binarize is None else binarize
+    image_format = ocr_image_format if image_format is None else image_format
+    max_bytes = ocr_max_image_bytes if max_bytes is None else max_bytes
+
+    image = ImageOps.exif_transpose(image)
+    image = image.convert("L") if grayscale or binarize else image.convert("RGB")
+    if binarize:
+        image = ImageOps.autocontrast(image).point(lambda value: 255 if value > ocr_binarize_threshold else 0)
+
+    quality = ocr_image_quality
+    while True:
+        image_bytes = encode_image(image, image_format, quality)
+        if len(image_bytes) <= max_bytes or min(image.size) < 200:
+            return image_bytes
+        if image_format != "PNG" and quality > 50:
+            quality -= 15
+        else:
+            image = image.resize((int(image.width * 0.8), int(image.height * 0.8)), Image.LANCZOS)
+
+# ===============================*** Text Extraction ***===============================
+
+def extract_text_from_uploads(sources):
+    """Extract the text of uploaded PDFs (file-like) and decoded images (PIL), concatenated in order.
+
+    Images and the scanned pages of every PDF share OCR batches.
+    """
+    # fitz documents are not thread-safe, so text extraction and rasterisation stay on this thread;
+    # only the OCR round-trips run in parallel
+    document_texts = []
+    ocr_pages = []
+    ocr_images_bytes = []
+    for file_index, file in enumerate(sources):
+        if isinstance(file, Image.Image):
+            document_texts.append([""])
+            ocr_pages.append((file_index, 0))
+            ocr_images_bytes.append(preprocess_image_for_ocr(file))
+            continue
+        pdf_document = fitz.open(stream=file.read(), filetype="pdf")
+        try:
+            page_texts = []
+            for page_num in range(len(pdf_document)):
+                page = pdf_document.load_page(page_num)
+                text = page.get_text()
+                page_texts.append(text)
+                if not text.strip():
+                    ocr_pages.append((file_index, page_num))
+                    ocr_images_bytes.append(preprocess_image_for_ocr(render_page_for_ocr(page)))
+            document_texts.append(page_texts)
+        finally:
+            pdf_document.close()
+
+    ocr_texts = dict(zip(ocr_pages, ocr_images(ocr_images_bytes))) if ocr_images_bytes else {}
+    return "".join(
+        text + ocr_texts.get((file_index, page_num), "")
+        for file_index, page_texts in enumerate(document_texts)
+        for page_num, text in enumerate(page_texts)
+    )
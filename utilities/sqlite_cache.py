@@ -0,0 +1,108 @@
+import os
+import time
+import sqlite3
+import threading
+
+# ===============================*** SQLite LRU Store ***===============================
+
+class SQLiteLRUCache:
+    """Size-capped key/value table in a local SQLite file; the least recently used entries are evicted first.
+
+    The table has key, value_column, size and last_used columns, plus namespace when namespaced, so a group
+    of entries can be dropped at once. setup_statements create whatever else the owning cache needs.
+    """
+
+    def __init__(self, path, table, value_column, max_bytes, namespaced=False, setup_statements=()):
+        self.path = path
+        self.table = table
+        self.value_column = value_column
+        self.max_bytes = max_bytes
+        self.namespaced = namespaced
+        self.setup_statements = setup_statements
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        if not self._initialized:
+            with self._init_lock, conn:
+                conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                    " key TEXT PRIMARY KEY,"
+                    + (" namespace TEXT NOT NULL," if self.namespaced else "")
+                    + f" {self.value_column} TEXT NOT NULL,"
+                    " size INTEGER NOT NULL,"
+                    " last_used REAL NOT NULL)"
+                )
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_last_used ON {self.table} (last_used)")
+                if self.namespaced:
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_namespace ON {self.table} (namespace)")
+                for statement in self.setup_statements:
+                    conn.execute(statement)
+                self._initialized = True
+        return conn
+
+    def get_many(self, keys):
+        """Return {key: value} for the keys that are cached, marking them as recently used."""
+        if not keys:
+            return {}
+        conn = self.connection()
+        unique_keys = list(dict.fromkeys(keys))
+        placeholders = ",".join("?" for _ in unique_keys)
+        rows = conn.execute(
+            f"SELECT key, {self.value_column} FROM {self.table} WHERE key IN ({placeholders})", unique_keys
+        ).fetchall()
+        if rows:
+            with conn:
+                conn.executemany(
+                    f"UPDATE {self.table} SET last_used = ? WHERE key = ?", [(time.time(), key) for key, _ in rows]
+                )
+        return dict(rows)
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, values, namespace=None):
+        """Store {key: value} and evict the least recently used entries beyond max_bytes."""
+        if not values:
+            return
+        conn = self.connection()
+        now = time.time()
+        columns = ["key", self.value_column, "size", "last_used"] + (["namespace"] if self.namespaced else [])
+        rows = [
+            (key, value, len(value.encode("utf-8")), now) + ((namespace,) if self.namespaced else ())
+            for key, value in values.items()
+        ]
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns[1:])
+        with conn:
+            conn.executemany(
+                f"INSERT INTO {self.table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)}) "
+                f"ON CONFLICT(key) DO UPDATE SET {updates}",
+                rows
+            )
+            self._evict(conn)
+
+    def put(self, key, value, namespace=None):
+        self.put_many({key: value}, namespace)
+
+    def delete_namespace(self, namespace, conn=None):
+        conn = conn or self.connection()
+        conn.execute(f"DELETE FROM {self.table} WHERE namespace = ?", (namespace,))
+
+    def _evict(self, conn):
+        total_size = conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+        for key, size in conn.execute(f"SELECT key, size FROM {self.table} ORDER BY last_used").fetchall():
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            total_size -= size
+            if total_size <= self.max_bytes:
+                break
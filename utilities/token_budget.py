@@ -0,0 +1,145 @@
+import os
+import re
+import threading
+import tiktoken
+import streamlit as st
+
+# ===============================*** Setup Configuration ***===============================
+
+# Prompt token budgets (optional [TokenBudget] section in secrets.toml)
+token_budget_settings = st.secrets.get("TokenBudget", {})
+default_prompt_budget = token_budget_settings.get("default_prompt_tokens", 12000)
+# Keyed by service kind, e.g. {"면접질문 생성" = 16000}; matched against the project's service_name
+service_prompt_budgets = token_budget_settings.get("service_prompt_tokens", {})
+# tiktoken downloads its BPE files on first use; point this at a pre-filled directory for offline hosts
+if token_budget_settings.get("tiktoken_cache_dir"):
+    os.environ.setdefault("TIKTOKEN_CACHE_DIR", token_budget_settings["tiktoken_cache_dir"])
+
+TRUNCATION_MARKER = "\n...(이하 생략)"
+
+encodings = {}
+encodings_lock = threading.Lock()
+
+
+class PromptBudgetError(ValueError):
+    """The fixed part of a prompt alone is larger than its token budget."""
+
+
+class ApproximateEncoding:
+    """Stand-in when tiktoken cannot load its BPE file: up to 4 ASCII characters or 1 other character per token.
+
+    Errs on the high side for Korean text, so budgets trimmed with it still fit.
+    """
+
+    token_pattern = re.compile(r"[\x00-\x7f]{1,4}|[^\x00-\x7f]", re.DOTALL)
+
+    def encode(self, text, disallowed_special=()):
+        return self.token_pattern.findall(text)
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+# ===============================*** Token Counting ***===============================
+
+def get_encoding(model):
+    encoding = encodings.get(model)
+    if encoding is None:
+        with encodings_lock:
+            encoding = encodings.get(model)
+            if encoding is None:
+                try:
+                    try:
+                        encoding = tiktoken.encoding_for_model(model)
+                    except KeyError:
+                        encoding = tiktoken.get_encoding("o200k_base")
+                except Exception as e:
+                    # Offline without a cached BPE file: estimate instead of failing every prompt
+                    print(f"Error loading the tiktoken encoding for {model}, using an estimate: {e}")
+                    encoding = ApproximateEncoding()
+                encodings[model] = encoding
+    return encoding
+
+def count_tokens(text, model):
+    return len(get_encoding(model).encode(text or "", disallowed_special=()))
+
+def count_message_tokens(messages, model):
+    # Each chat message carries a few tokens of role/formatting overhead
+    return sum(count_tokens(message["content"], model) + 4 for message in messages) + 3
+
+def truncate_to_tokens(text, max_tokens, model):
+    """Cut text down to max_tokens (marker included), always keeping the beginning."""
+    encoding = get_encoding(model)
+    tokens = encoding.encode(text or "", disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    keep = max_tokens - count_tokens(TRUNCATION_MARKER, model)
+    if keep <= 0:
+        return ""
+    # A cut in the middle of a multi-byte character decodes to a replacement character
+    return encoding.decode(tokens[:keep]).rstrip("\ufffd") + TRUNCATION_MARKER
+
+# ===============================*** Prompt Budgeting ***===============================
+
+def get_prompt_budget(selected_project, service_name):
+    if selected_project and selected_project.get('max_prompt_tokens'):
+        return selected_project['max_prompt_tokens']
+    for service_kind, budget in service_prompt_budgets.items():
+        if service_kind in (service_name or ""):
+            return budget
+    return default_prompt_budget
+
+def get_section_caps(section_tokens, available):
+    """Water-fill available tokens over the sections: short sections stay whole, the longest share what is left."""
+    caps = dict(section_tokens)
+    remaining = available
+    # Sorted by size, then name, so the same input always trims the same way
+    ordered = sorted(section_tokens.items(), key=lambda item: (item[1], item[0]))
+    for index, (name, tokens) in enumerate(ordered):
+        share = max(remaining, 0) // (len(ordered) - index)
+        if tokens > share:
+            for larger_name, _ in ordered[index:]:
+                caps[larger_name] = share
+            break
+        remaining -= tokens
+    return caps
+
+def count_parts_tokens(parts, model):
+    return sum(count_tokens(part, model) for part in parts)
+
+def fit_prompt_to_budget(render, sections, budget, model):
+    """Render the prompt with sections trimmed so that all of its text parts fit in budget tokens.
+
+    render(sections) returns the prompt's text parts, e.g. the (prefix, prompt) pair of build_prompt_layout;
+    sections are the long, trimmable fields (student records, uploaded text).
+    Returns (parts, usage) where usage records the token counts before and after trimming.
+    """
+    section_tokens = {name: count_tokens(text, model) for name, text in sections.items()}
+    original_parts = render(sections)
+    usage = {
+        "budget": budget,
+        "original_prompt_tokens": count_parts_tokens(original_parts, model),
+        "truncated_sections": [],
+    }
+    if usage["original_prompt_tokens"] <= budget:
+        usage["prompt_tokens"] = usage["original_prompt_tokens"]
+        return original_parts, usage
+
+    fixed_tokens = count_parts_tokens(render({name: "" for name in sections}), model)
+    if fixed_tokens >= budget:
+        raise PromptBudgetError(f"Prompt template alone needs {fixed_tokens} tokens, over the budget of {budget}")
+
+    available = budget - fixed_tokens
+    while True:
+        caps = get_section_caps(section_tokens, available)
+        trimmed = {name: truncate_to_tokens(text, caps[name], model) for name, text in sections.items()}
+        parts = render(trimmed)
+        prompt_tokens = count_parts_tokens(parts, model)
+        # Tokens merge across section boundaries, so the total can overshoot by a few; tighten and retry
+        if prompt_tokens <= budget or available <= 0:
+            break
+        available -= prompt_tokens - budget
+
+    usage["prompt_tokens"] = prompt_tokens
+    usage["truncated_sections"] = sorted(name for name in sections if trimmed[name] != sections[name])
+    return parts, usage